@@ -0,0 +1,425 @@
+'''
+Endpoint benchmarks for the trivia API.
+
+Seeds a synthetic question bank per size in SQLite (or in the database of
+--database-url, e.g. a local Postgres), then drives each endpoint through
+the Flask test client and through a concurrent HTTP load generator against
+a local threaded server, and reports p50/p99 latency and requests/second.
+With --asgi the same HTTP load also runs against the async app of
+flaskr.asgi served by uvicorn, to compare both serving modes.
+Requests send the Accept-Encoding of --accept-encoding and the mean bytes
+per response body, as sent on the wire, are reported with the latency, so
+runs with and without compression show both effects.
+The response cache of GET endpoints is off (RESPONSE_CACHE_SIZE=0), so the
+views and queries are measured rather than cache hits; --response-cache
+runs every size once more with it on, reported as the cached drivers
+(test_client and http only, the async app has no response cache).
+Results are written as JSON so runs of two commits can be compared:
+
+    python benchmarks/bench_endpoints.py --sizes 1000,100000 --output before.json
+    python benchmarks/bench_endpoints.py --sizes 1000,100000 --output after.json --compare before.json
+
+Each size runs in its own process, so the in-process caches of one size
+do not leak into the next. Banks are kept in --data-dir and reused. Only
+databases seeded by the benchmark are rewritten, unless --reset.
+'''
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+#----------------------------------------------------------------------------#
+# Constants
+#----------------------------------------------------------------------------#
+WORDS = ['river', 'mountain', 'painting', 'ancient', 'king', 'planet', 'ocean', 'novel',
+         'battle', 'city', 'film', 'actor', 'element', 'island', 'empire', 'composer',
+         'desert', 'bridge', 'poet', 'invention', 'team', 'medal', 'language', 'animal',
+         'temple', 'volcano', 'symphony', 'treaty', 'galaxy', 'forest', 'museum', 'castle']
+CATEGORIES = ['Science', 'Art', 'Geography', 'History', 'Entertainment', 'Sports']
+SEED_CHUNK = 10000
+# marks the databases seeded by the benchmark, the only ones it rewrites
+BANK_TABLE = 'benchmark_bank'
+
+'''
+Endpoints
+    name -> function(random, bank size) returning (method, url, json body)
+'''
+ENDPOINTS = {
+    'GET /questions': lambda rnd, size: (
+        'GET', '/questions?page={}'.format(rnd.randint(1, max(1, min(size, 1000) // 10))), None),
+    'POST /questions/search': lambda rnd, size: (
+        'POST', '/questions/search', {'searchTerm': rnd.choice(WORDS)}),
+    # one keystroke of a search term being typed
+    'GET /questions/suggest': lambda rnd, size: (
+        'GET', '/questions/suggest?prefix={}'.format(rnd.choice(WORDS)[:rnd.randint(1, 5)]), None),
+    'GET /categories/<id>/questions': lambda rnd, size: (
+        'GET', '/categories/{}/questions'.format(rnd.randint(1, len(CATEGORIES))), None),
+    'POST /quizzes': lambda rnd, size: (
+        'POST', '/quizzes', {
+            'previous_questions': [rnd.randint(1, size) for _ in range(4)],
+            'quiz_category': {'id': rnd.randint(1, len(CATEGORIES)), 'type': ''}
+        }),
+    'POST /quizzes difficulty_curve': lambda rnd, size: (
+        'POST', '/quizzes', {
+            'previous_questions': [rnd.randint(1, size) for _ in range(4)],
+            'quiz_category': {'id': rnd.randint(1, len(CATEGORIES)), 'type': ''},
+            'count': 5,
+            'difficulty_curve': [1, 2, 3, 4, 5]
+        }),
+}
+# routes or options the async app does not serve, not driven with --asgi
+WSGI_ONLY_ENDPOINTS = {'GET /questions/suggest', 'POST /quizzes difficulty_curve'}
+#----------------------------------------------------------------------------#
+# Question Bank
+#----------------------------------------------------------------------------#
+'''
+Seed Bank
+Parameters: number of questions, whether a database the benchmark did not
+            create may be emptied
+Return: None, fills the configured database unless it already holds size
+        questions; exits when the database has tables but no BANK_TABLE,
+        unless reset
+'''
+def seed_bank(size, reset=False):
+    from sqlalchemy import inspect, Table, Column, Integer, MetaData
+    from models import db, Question, Category, reconcile_category_counts
+
+    bank = Table(BANK_TABLE, MetaData(), Column('id', Integer, primary_key=True))
+    inspector = inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    if BANK_TABLE not in tables:
+      if tables and not reset:
+        sys.exit('{} holds tables the benchmark did not create; use an empty database, '
+                 'or --reset to replace its questions and categories'.format(db.engine.url))
+      rebuild = True
+    else:
+      # create_app leaves the schema alone: banks kept from an older schema are rebuilt
+      rebuild = any(set(table.columns.keys()) - {column['name'] for column in inspector.get_columns(table.name)}
+                    for table in db.metadata.sorted_tables if table.name in tables)
+    if rebuild:
+      db.drop_all()
+      db.create_all()
+      if db.engine.dialect.name == 'postgresql':
+        # the trigram index of the migrations, unknown to create_all
+        db.session.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        db.session.execute('CREATE INDEX ix_questions_question_trgm ON questions '
+                           'USING gin (question gin_trgm_ops)')
+        db.session.commit()
+      bank.create(db.engine, checkfirst=True)
+    if db.session.query(Category.id).count() != len(CATEGORIES):
+      db.session.query(Question).delete()
+      db.session.query(Category).delete()
+      db.session.execute(Category.__table__.insert(),
+                         [{'id': id, 'type': type} for id, type in enumerate(CATEGORIES, start=1)])
+      db.session.commit()
+    if db.session.query(Question.id).count() == size:
+      # banks seeded before categories kept a question count
+      reconcile_category_counts()
+      db.session.commit()
+      return
+
+    db.session.query(Question).delete()
+    rnd = random.Random(size)
+    for start in range(0, size, SEED_CHUNK):
+      db.session.execute(Question.__table__.insert(), [{
+          'id': id,
+          'question': ' '.join(rnd.choice(WORDS) for _ in range(8)) + '?',
+          'answer': rnd.choice(WORDS),
+          'category': rnd.randint(1, len(CATEGORIES)),
+          'difficulty': rnd.randint(1, 5)
+      } for id in range(start + 1, min(start + SEED_CHUNK, size) + 1)])
+      db.session.commit()
+    # Core inserts skip the category question counts
+    reconcile_category_counts()
+    db.session.commit()
+#----------------------------------------------------------------------------#
+# Drivers
+#----------------------------------------------------------------------------#
+'''
+Summarize
+Parameters: list of latencies in seconds, wall time of the run, error count,
+            list of response body sizes
+Return: dict of p50/p99/mean in ms, requests per second and mean bytes
+'''
+def summarize(latencies, elapsed, errors, sizes):
+    latencies = sorted(latencies)
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(p / 100.0 * len(latencies)))] * 1000
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': round(percentile(50), 3),
+        'p99_ms': round(percentile(99), 3),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+        'req_per_s': round(len(latencies) / elapsed, 1),
+        'bytes': round(sum(sizes) / len(sizes))
+    }
+
+'''
+OK
+Parameters: HTTP status code
+Return: whether the response answered the request, any other is an error
+'''
+def ok(status):
+    return 200 <= status < 300 or status == 304
+
+'''
+Run Test Client
+    sequential requests through the Flask test client, no sockets involved
+'''
+def run_test_client(app, endpoint, size, requests, accept_encoding):
+    client = app.test_client()
+    rnd = random.Random(1)
+    latencies, sizes, errors = [], [], 0
+    started = time.perf_counter()
+    for _ in range(requests):
+      method, url, body = ENDPOINTS[endpoint](rnd, size)
+      start = time.perf_counter()
+      res = client.open(url, method=method, json=body, headers={'Accept-Encoding': accept_encoding})
+      latencies.append(time.perf_counter() - start)
+      sizes.append(len(res.data))
+      errors += not ok(res.status_code)
+    return summarize(latencies, time.perf_counter() - started, errors, sizes)
+
+'''
+Run HTTP
+    concurrent requests from a thread pool against a local threaded server
+'''
+def run_http(base_url, endpoint, size, requests, concurrency, accept_encoding):
+    rnd = random.Random(2)
+    calls = [ENDPOINTS[endpoint](rnd, size) for _ in range(requests)]
+
+    def call(request):
+        method, url, body = request
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        req = urllib.request.Request(base_url + url, data=data, method=method,
+                                     headers={'Content-Type': 'application/json',
+                                              'Accept-Encoding': accept_encoding})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req) as res:
+                received = len(res.read())
+            failed = False
+        except urllib.error.HTTPError as error:
+            received = len(error.read())
+            failed = not ok(error.code)
+        return time.perf_counter() - start, failed, received
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        outcomes = list(pool.map(call, calls))
+    elapsed = time.perf_counter() - started
+    return summarize([latency for latency, _, _ in outcomes], elapsed,
+                     sum(failed for _, failed, _ in outcomes),
+                     [received for _, _, received in outcomes])
+
+'''
+Serve
+Parameters: flask app
+Return: base url of the app served by a threaded server in a daemon thread
+'''
+def serve(app):
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return 'http://127.0.0.1:{}'.format(server.server_port)
+
+'''
+Serve ASGI
+Parameters: database url
+Return: base url of the async app of flaskr.asgi served by uvicorn in a
+        daemon thread, with its own event loop
+'''
+def serve_asgi(database_url):
+    import uvicorn
+    from flaskr.asgi import create_asgi_app
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    server = uvicorn.Server(uvicorn.Config(create_asgi_app(database_url), log_level='error'))
+    threading.Thread(target=server.run, kwargs={'sockets': [sock]}, daemon=True).start()
+    while not server.started:
+      time.sleep(0.01)
+    return 'http://127.0.0.1:{}'.format(sock.getsockname()[1])
+#----------------------------------------------------------------------------#
+# Runs
+#----------------------------------------------------------------------------#
+'''
+Bench Size
+    runs every endpoint against a bank of the given size, in this process
+'''
+def bench_size(args, size):
+    from config import RESPONSE_CACHE_SIZE
+    from flaskr import create_app
+    from models import db, database_path
+
+    app = create_app()
+    with app.app_context():
+      started = time.perf_counter()
+      seed_bank(size, args.reset)
+      seeded_in = time.perf_counter() - started
+      db.session.remove()
+
+    results = []
+    base_url = serve(app) if args.concurrency > 0 else None
+    # the async app has no response cache, the cached run only repeats the WSGI drivers
+    asgi_url = (serve_asgi(database_path)
+                if args.asgi and args.concurrency > 0 and RESPONSE_CACHE_SIZE == 0 else None)
+    for endpoint in args.endpoints:
+      # warm caches and connections before measuring
+      run_test_client(app, endpoint, size, min(20, args.requests), args.accept_encoding)
+      result = run_test_client(app, endpoint, size, args.requests, args.accept_encoding)
+      results.append(dict(size=size, endpoint=endpoint, driver='test_client', **result))
+      if base_url:
+        result = run_http(base_url, endpoint, size, args.requests, args.concurrency,
+                          args.accept_encoding)
+        results.append(dict(size=size, endpoint=endpoint, driver='http',
+                            concurrency=args.concurrency, **result))
+      if asgi_url and endpoint not in WSGI_ONLY_ENDPOINTS:
+        run_http(asgi_url, endpoint, size, min(20, args.requests), args.concurrency,
+                 args.accept_encoding)
+        result = run_http(asgi_url, endpoint, size, args.requests, args.concurrency,
+                          args.accept_encoding)
+        results.append(dict(size=size, endpoint=endpoint, driver='asgi',
+                            concurrency=args.concurrency, **result))
+    for result in results:
+      result['response_cache'] = RESPONSE_CACHE_SIZE > 0
+    return {'size': size, 'seed_s': round(seeded_in, 2), 'results': results}
+
+'''
+Database Url
+Parameters: parsed arguments, bank size
+Return: --database-url, or a SQLite file per size in --data-dir
+'''
+def database_url(args, size):
+    if args.database_url:
+      return args.database_url
+    os.makedirs(args.data_dir, exist_ok=True)
+    return 'sqlite:///' + os.path.join(args.data_dir, 'bench_{}.db'.format(size))
+
+def git_commit():
+    try:
+      return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                                     stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+      return None
+
+def driver_name(result):
+    return result['driver'] + (' cached' if result.get('response_cache') else '')
+
+'''
+Compare
+    prints the change of p50, p99, req/s and bytes against an earlier results file
+'''
+def compare(report, baseline_path):
+    with open(baseline_path) as f:
+      baseline = {(r['size'], r['endpoint'], driver_name(r)): r
+                  for run in json.load(f)['runs'] for r in run['results']}
+    print('\n{:>8} {:<32} {:<18} {:>10} {:>10} {:>10} {:>10}'.format(
+        'size', 'endpoint', 'driver', 'p50', 'p99', 'req/s', 'bytes'))
+    for run in report['runs']:
+      for r in run['results']:
+        old = baseline.get((r['size'], r['endpoint'], driver_name(r)))
+        if old is None:
+          continue
+        change = lambda key: '{:+.1f}%'.format((r[key] - old[key]) / old[key] * 100
+                                               if old.get(key) and key in r else 0)
+        print('{:>8} {:<32} {:<18} {:>10} {:>10} {:>10} {:>10}'.format(
+            r['size'], r['endpoint'], driver_name(r), change('p50_ms'), change('p99_ms'),
+            change('req_per_s'), change('bytes')))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the trivia API endpoints.')
+    parser.add_argument('--sizes', default='1000,100000',
+                        help='comma separated question bank sizes, e.g. 1000,100000,1000000')
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint and driver')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='HTTP load generator threads, 0 to only use the test client')
+    parser.add_argument('--asgi', action='store_true',
+                        help='also drive the async app of flaskr.asgi under uvicorn over HTTP')
+    parser.add_argument('--accept-encoding', default='identity',
+                        help='Accept-Encoding header of every request, e.g. gzip or br')
+    parser.add_argument('--response-cache', action='store_true',
+                        help='also run every size with the response cache on, reported separately')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS),
+                        help='comma separated endpoints to run')
+    parser.add_argument('--database-url', default=None,
+                        help='database to seed and use instead of SQLite files, e.g. a local Postgres')
+    parser.add_argument('--reset', action='store_true',
+                        help='seed --database-url even when the benchmark did not create it, '
+                             'replacing its questions and categories')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'trivia-bench'),
+                        help='where SQLite banks are kept between runs')
+    parser.add_argument('--output', default='bench_results.json', help='JSON results file')
+    parser.add_argument('--compare', default=None, help='earlier JSON results file to compare with')
+    parser.add_argument('--size', type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    args.endpoints = [endpoint for endpoint in args.endpoints.split(',') if endpoint]
+    unknown = set(args.endpoints) - set(ENDPOINTS)
+    if unknown:
+      parser.error('unknown endpoints: {}'.format(', '.join(sorted(unknown))))
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.size is not None:
+      # child process: the database url is already in the environment
+      sys.path.insert(0, BACKEND_DIR)
+      json.dump(bench_size(args, args.size), sys.stdout)
+      return
+
+    runs = []
+    for size in [int(size) for size in args.sizes.split(',')]:
+      for cached in [False, True] if args.response_cache else [False]:
+        env = dict(os.environ, DATABASE_URL=database_url(args, size))
+        if cached:
+          env.pop('RESPONSE_CACHE_SIZE', None)
+        else:
+          # a repeated url would be answered from the cache without running the view
+          env['RESPONSE_CACHE_SIZE'] = '0'
+        child_args = [arg for arg in (argv if argv is not None else sys.argv[1:])]
+        try:
+          output = subprocess.check_output(
+              [sys.executable, os.path.abspath(__file__)] + child_args + ['--size', str(size)],
+              env=env, cwd=BACKEND_DIR)
+        except subprocess.CalledProcessError as error:
+          # the child printed why
+          sys.exit(error.returncode)
+        run = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+        runs.append(run)
+        for r in run['results']:
+          print('{:>8} {:<32} {:<18} p50 {:>8.2f} ms  p99 {:>8.2f} ms  {:>8.1f} req/s  {:>8} B  errors {}'.format(
+              r['size'], r['endpoint'], driver_name(r), r['p50_ms'], r['p99_ms'], r['req_per_s'],
+              r['bytes'], r['errors']))
+
+    report = {
+        'commit': git_commit(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'database': args.database_url or 'sqlite',
+        'accept_encoding': args.accept_encoding,
+        'runs': runs
+    }
+    with open(args.output, 'w') as f:
+      json.dump(report, f, indent=2)
+    print('\nresults written to {}'.format(args.output))
+    if args.compare:
+      compare(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+'''
+Read path benchmarks: CPU time and allocations per question row.
+
+Compares, for pages of questions fetched from a synthetic bank, the ORM
+path (Question objects, Question.format(), stdlib json) with the column
+projected path of flaskr.pagination (plain rows, format_question_rows)
+serialized by each available encoder of flaskr.encoder, with and without
+a ?fields= projection:
+
+    python benchmarks/bench_serialization.py --size 10000 --rows 10,1000
+
+Time is the best of --repeat runs; allocations are the tracemalloc peak
+of one run, both divided by the number of rows.
+'''
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+#----------------------------------------------------------------------------#
+# Read Paths
+#----------------------------------------------------------------------------#
+'''
+Read Paths
+Parameters: number of rows
+Return: name -> function fetching and serializing that many questions
+'''
+def read_paths(rows):
+    from models import db, Question
+    from flaskr.encoder import ENCODERS, get_encoder
+    from flaskr.pagination import QUESTION_FIELDS, parse_fields, format_question_rows
+
+    def orm():
+        questions = Question.query.order_by(Question.id).limit(rows).all()
+        return json.dumps([question.format() for question in questions])
+
+    def projected(dumps, fields):
+        def run():
+            selection = db.session.query(*[getattr(Question, field) for field in fields])
+            return dumps(format_question_rows(selection.order_by(Question.id).limit(rows).all(), fields))
+        return run
+
+    paths = {'orm + stdlib': orm}
+    for name in ENCODERS:
+      try:
+        dumps = get_encoder(name)
+      except ImportError:
+        continue
+      paths['projected + ' + name] = projected(dumps, QUESTION_FIELDS)
+      paths['projected fields=question + ' + name] = projected(dumps, parse_fields('question'))
+    return paths
+
+'''
+Measure
+Parameters: function, number of rows, repeats
+Return: (best microseconds per row, peak allocated bytes per row)
+'''
+def measure(function, rows, repeat):
+    function()
+    best = float('inf')
+    for _ in range(repeat):
+      start = time.perf_counter()
+      function()
+      best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best / rows * 1e6, peak / rows
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the question read path per row.')
+    parser.add_argument('--size', type=int, default=10000, help='questions in the bank')
+    parser.add_argument('--rows', default='10,1000', help='comma separated rows per read')
+    parser.add_argument('--repeat', type=int, default=50, help='timed runs, the best one counts')
+    parser.add_argument('--database-url', default=None,
+                        help='database to seed and use instead of a SQLite file')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'trivia-bench'),
+                        help='where SQLite banks are kept between runs')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.database_url is None:
+      os.makedirs(args.data_dir, exist_ok=True)
+      args.database_url = 'sqlite:///' + os.path.join(args.data_dir, 'bench_{}.db'.format(args.size))
+    os.environ['DATABASE_URL'] = args.database_url
+
+    from flaskr import create_app
+    from bench_endpoints import seed_bank
+
+    app = create_app()
+    with app.app_context():
+      seed_bank(args.size)
+      print('{:>6} {:<36} {:>10} {:>12}'.format('rows', 'path', 'us/row', 'bytes/row'))
+      for rows in [int(rows) for rows in args.rows.split(',')]:
+        for name, function in read_paths(rows).items():
+          per_row, allocated = measure(function, rows, args.repeat)
+          print('{:>6} {:<36} {:>10.2f} {:>12.0f}'.format(rows, name, per_row, allocated))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+'''
+Startup benchmarks: how long a new worker takes before it can serve.
+
+Each run starts a fresh interpreter, as a gunicorn worker boot or recycle
+does, and measures the import of flaskr and the create_app() call. It also
+counts the database connections opened meanwhile, which should be none:
+the engine connects on the first request. The median over --runs is
+checked against a budget, so a slow import is noticed in review:
+
+    python benchmarks/bench_startup.py --runs 10 --budget-ms 800
+
+Exits with status 1 when the budget is exceeded or the boot connects to
+the database. --importtime lists the slowest modules to import.
+'''
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# run in the fresh interpreter, prints the timings as JSON
+BOOT = '''
+import json, time
+start = time.perf_counter()
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+connections = []
+event.listen(Pool, 'connect', lambda *args: connections.append(1))
+imported = time.perf_counter()
+from flaskr import create_app
+app_imported = time.perf_counter()
+app = create_app()
+booted = time.perf_counter()
+print(json.dumps({
+    'import_ms': (app_imported - imported) * 1000,
+    'create_app_ms': (booted - app_imported) * 1000,
+    'total_ms': (booted - start) * 1000,
+    'connections': len(connections)
+}))
+'''
+#----------------------------------------------------------------------------#
+# Runs
+#----------------------------------------------------------------------------#
+'''
+Boot
+Parameters: environment of the interpreter
+Return: dict of import, create_app and total milliseconds, connections made
+'''
+def boot(env):
+    output = subprocess.check_output([sys.executable, '-c', BOOT], env=env, cwd=BACKEND_DIR)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+'''
+Slowest Imports
+Parameters: environment of the interpreter, number of modules
+Return: list of (cumulative milliseconds, module) imported by flaskr
+'''
+def slowest_imports(env, count):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import flaskr'],
+                            env=env, cwd=BACKEND_DIR, stderr=subprocess.PIPE,
+                            stdout=subprocess.DEVNULL, check=True)
+    modules = []
+    for line in result.stderr.decode('utf-8').splitlines():
+      match = re.match(r'import time:\s+\d+ \|\s+(\d+) \|( *)(\S+)', line)
+      # top level imports of flaskr only, their time includes their own imports
+      if match and len(match.group(2)) <= 3:
+        modules.append((int(match.group(1)) / 1000.0, match.group(3)))
+    return sorted(modules, reverse=True)[:count]
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the boot time of a worker.')
+    parser.add_argument('--runs', type=int, default=10, help='fresh interpreters to boot')
+    parser.add_argument('--budget-ms', type=float, default=800,
+                        help='largest median import + create_app time allowed')
+    parser.add_argument('--importtime', type=int, default=0, metavar='N',
+                        help='also list the N slowest modules imported by flaskr')
+    parser.add_argument('--database-url', default=None,
+                        help='database of the app, an unused SQLite file by default')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    env = dict(os.environ, DATABASE_URL=args.database_url or
+               'sqlite:///' + os.path.join(tempfile.gettempdir(), 'trivia-startup.db'))
+    runs = [boot(env) for _ in range(args.runs)]
+
+    print('{:<16} {:>10} {:>10}'.format('', 'median', 'max'))
+    for key in ('import_ms', 'create_app_ms', 'total_ms'):
+      values = [run[key] for run in runs]
+      print('{:<16} {:>10.1f} {:>10.1f}'.format(key, median(values), max(values)))
+    connections = max(run['connections'] for run in runs)
+    print('connections at boot: {}'.format(connections))
+
+    if args.importtime:
+      print('\nslowest imports (cumulative ms):')
+      for elapsed, module in slowest_imports(env, args.importtime):
+        print('{:>10.1f}  {}'.format(elapsed, module))
+
+    total = median([run['total_ms'] for run in runs])
+    if total > args.budget_ms or connections:
+      print('\nover budget: {:.1f} ms (budget {:.0f} ms), {} connections'.format(
+          total, args.budget_ms, connections))
+      sys.exit(1)
+    print('\nwithin budget: {:.1f} ms (budget {:.0f} ms)'.format(total, args.budget_ms))
+
+
+if __name__ == '__main__':
+    main()
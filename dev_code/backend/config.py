@@ -1,17 +1,145 @@
 import os
-SECRET_KEY = os.urandom(32)
+# Every setting below can be overridden by an environment variable of the
+# same name, e.g. DB_POOL_SIZE=10 flask run
+
+
+def env(name, default):
+    return os.environ.get(name, default)
+
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def env_float(name, default):
+    return float(os.environ.get(name, default))
+
+
+def env_bool(name, default):
+    return os.environ.get(name, str(default)).lower() in ('1', 'true', 'yes', 'on')
+
+
+# Set SECRET_KEY when running several workers, so they all sign alike.
+SECRET_KEY = env('SECRET_KEY', None) or os.urandom(32)
 # Grabs the folder where the script runs.
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 # Enable debug mode.
-DEBUG = True
+DEBUG = env_bool('DEBUG', False)
 
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Database connection pool, per worker process. With gunicorn, keep
+# workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) below the server's max_connections.
+DB_POOL_SIZE = env_int('DB_POOL_SIZE', 5)
+DB_MAX_OVERFLOW = env_int('DB_MAX_OVERFLOW', 10)
+# Seconds to wait for a free connection before failing the request.
+DB_POOL_TIMEOUT = env_int('DB_POOL_TIMEOUT', 30)
+# Seconds after which a connection is replaced, below any server or proxy idle timeout.
+DB_POOL_RECYCLE = env_int('DB_POOL_RECYCLE', 1800)
+# Test connections with a ping before use, so restarted servers do not fail requests.
+DB_POOL_PRE_PING = env_bool('DB_POOL_PRE_PING', True)
+# Postgres statement_timeout in milliseconds (0 disables it).
+DB_STATEMENT_TIMEOUT = env_int('DB_STATEMENT_TIMEOUT', 0)
+
+# Seconds the categories table is served from memory before it is reloaded.
+CATEGORY_CACHE_TTL = env_int('CATEGORY_CACHE_TTL', 300)
+
+# Seconds the total number of questions is maintained in memory before it
+# is counted again.
+QUESTION_COUNT_TTL = env_int('QUESTION_COUNT_TTL', 300)
+
+# Where quiz session decks are kept: 'memory' (single process only, quiz
+# sessions are off with more WEB_CONCURRENCY), a redis:// url, or
+# fakeredis:// for a local Redis-compatible stand-in.
+QUIZ_SESSION_STORE = env('QUIZ_SESSION_STORE', 'memory')
+# Seconds an idle quiz session is kept.
+QUIZ_SESSION_TTL = env_int('QUIZ_SESSION_TTL', 3600)
+
+# Most questions a single POST /quizzes may deal with {"count": n}.
+QUIZ_BATCH_MAX = env_int('QUIZ_BATCH_MAX', 50)
+
+# Serve question pages, totals and quiz draws from an in-process snapshot
+# of the questions table instead of the database.
+READ_MODEL = env_bool('READ_MODEL', False)
+# How the snapshot learns about writes of other processes: 'version'
+# (reload when the data version moved) or 'notify' (Postgres LISTEN/NOTIFY).
+READ_MODEL_REFRESH = env('READ_MODEL_REFRESH', 'version')
+# Bytes the snapshot may use per process; beyond it reads go to the database.
+READ_MODEL_MAX_BYTES = env_int('READ_MODEL_MAX_BYTES', 64 * 1024 * 1024)
+
+# Question search backend: 'sql' (ILIKE, served by the pg_trgm index on
+# Postgres), 'index' (in-process trigram index) or 'auto' (sql on Postgres).
+SEARCH_BACKEND = env('SEARCH_BACKEND', 'auto')
+# Most completions GET /questions/suggest returns, also kept per prefix.
+SUGGEST_LIMIT = env_int('SUGGEST_LIMIT', 10)
+# Seconds the suggestion index is used before being built again, when the
+# workers keep their own data version and do not see each other's writes.
+SUGGEST_MAX_AGE = env_int('SUGGEST_MAX_AGE', 10)
+
+# Questions inserted per executemany and commit by POST /questions/bulk.
+BULK_BATCH_SIZE = env_int('BULK_BATCH_SIZE', 500)
+# Rows fetched per round trip from the server-side cursor of GET /questions/export.
+EXPORT_BATCH_SIZE = env_int('EXPORT_BATCH_SIZE', 1000)
+
+# Where the data version driving ETags is kept: 'memory' (single process
+# only) or a redis:// / fakeredis:// url shared by all worker processes.
+DATA_VERSION_STORE = env('DATA_VERSION_STORE', 'memory')
+# Worker processes serving the app, set by gunicorn.conf.py for its workers.
+# With more than one and a 'memory' data version, ETags and the response
+# cache are turned off: a worker would not see the writes of the others.
+WEB_CONCURRENCY = env_int('WEB_CONCURRENCY', 1)
+# Serialized GET responses kept in memory per url and data version (0 disables).
+RESPONSE_CACHE_SIZE = env_int('RESPONSE_CACHE_SIZE', 256)
+# Cache-Control max-age of GET responses; clients revalidate with ETags after it.
+HTTP_CACHE_MAX_AGE = env_int('HTTP_CACHE_MAX_AGE', 0)
+
+# Response compression: encodings in order of preference, among gzip, br
+# (needs brotli) and zstd (needs zstandard); empty to disable compression.
+COMPRESSION_ENCODINGS = [encoding for encoding in env('COMPRESSION_ENCODINGS', 'zstd,br,gzip').split(',') if encoding]
+# Bodies smaller than this many bytes are sent uncompressed.
+COMPRESSION_MIN_SIZE = env_int('COMPRESSION_MIN_SIZE', 1024)
+# Compression levels: gzip 1-9, brotli 0-11, zstd 1-22.
+COMPRESSION_GZIP_LEVEL = env_int('COMPRESSION_GZIP_LEVEL', 6)
+COMPRESSION_BROTLI_LEVEL = env_int('COMPRESSION_BROTLI_LEVEL', 4)
+COMPRESSION_ZSTD_LEVEL = env_int('COMPRESSION_ZSTD_LEVEL', 3)
+# Compressed bodies of cached GET responses kept in memory (0 disables).
+COMPRESSION_CACHE_SIZE = env_int('COMPRESSION_CACHE_SIZE', 256)
+
+# JSON encoder of API responses: 'orjson', 'stdlib' or 'auto' (orjson when installed).
+JSON_ENCODER = env('JSON_ENCODER', 'auto')
+
+# Add a Server-Timing header (database and total time) to every response.
+SERVER_TIMING = env_bool('SERVER_TIMING', True)
+
+# Profile a sample of live requests (see python profile_report.py report).
+PROFILE_ENABLED = env_bool('PROFILE_ENABLED', False)
+# Share of requests profiled when enabled, between 0 and 1.
+PROFILE_SAMPLE_RATE = env_float('PROFILE_SAMPLE_RATE', 0.01)
+# Requests with an X-Profile header signed with this secret are always
+# profiled, even when profiling is not enabled (python profile_report.py sign).
+PROFILE_SECRET = env('PROFILE_SECRET', None)
+# 'pstats' (cProfile) or 'collapsed' (sampled stacks for flame graphs).
+PROFILE_FORMAT = env('PROFILE_FORMAT', 'pstats')
+PROFILE_DIR = env('PROFILE_DIR', os.path.join(basedir, 'profiles'))
+# Oldest profiles are removed beyond this many files or bytes.
+PROFILE_MAX_FILES = env_int('PROFILE_MAX_FILES', 500)
+PROFILE_MAX_BYTES = env_int('PROFILE_MAX_BYTES', 100 * 1024 * 1024)
+
+# Comma separated SQLAlchemy urls of read replicas; read-only endpoints are
+# spread over them round-robin, writes stay on the primary.
+DATABASE_REPLICA_URLS = [url for url in env('DATABASE_REPLICA_URLS', '').split(',') if url]
+# Seconds before a failed replica is checked again.
+REPLICA_HEALTH_INTERVAL = env_int('REPLICA_HEALTH_INTERVAL', 10)
+# Seconds a client reads from the primary after its own write (read-your-writes).
+REPLICA_STICKY_SECONDS = env_int('REPLICA_STICKY_SECONDS', 5)
+
 database_setup = {
-    'database_name': 'trivia',
-    'database_name_test': 'trivia_test',
-    'user_name': 'postgres',  
-    'password': None,  
-    'port': 'localhost:5432' 
+    'database_name': env('DB_NAME', 'trivia'),
+    'database_name_test': env('DB_NAME_TEST', 'trivia_test'),
+    'user_name': env('DB_USER', 'postgres'),
+    'password': env('DB_PASSWORD', None),
+    'port': env('DB_HOST', 'localhost:5432')
 }
+# Full SQLAlchemy url, overrides database_setup when set.
+DATABASE_URL = env('DATABASE_URL', None)
@@ -1,37 +1,42 @@
 #----------------------------------------------------------------------------#
 # Imports
 #----------------------------------------------------------------------------#
-from logging import error
 import os
-from flask import Flask, request, abort, jsonify, flash
-from flask.globals import session 
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import (func,
-                        inspect)
+from flask import Flask, Response, request, abort, flash, stream_with_context
+from sqlalchemy import func
 from flask_cors import CORS
 import random
-from sqlalchemy.sql.elements import Null
-from models import (setup_db, Question, Category, session_commit, session_rollback, session_close)
-from flask_sqlalchemy import SQLAlchemy
+from models import (database_path, setup_db, setup_migrations, db, ping_database, pool_status, Question, category_cache, data_version, question_counter,
+                    unit_of_work, session_rollback, category_question_counts, category_question_count,
+                    reconcile_category_counts)
 from sqlalchemy import exc
-from config import SECRET_KEY
-#----------------------------------------------------------------------------#
-# Constants
-#----------------------------------------------------------------------------#
-QUESTIONS_PER_PAGE = 10
-db = SQLAlchemy()
+from config import (SECRET_KEY, DEBUG, QUIZ_SESSION_STORE, QUIZ_SESSION_TTL, QUIZ_BATCH_MAX, SEARCH_BACKEND,
+                    SUGGEST_LIMIT, SUGGEST_MAX_AGE,
+                    DATA_VERSION_STORE, WEB_CONCURRENCY, RESPONSE_CACHE_SIZE, HTTP_CACHE_MAX_AGE,
+                    BULK_BATCH_SIZE, EXPORT_BATCH_SIZE, SERVER_TIMING, JSON_ENCODER,
+                    PROFILE_ENABLED, PROFILE_SAMPLE_RATE, PROFILE_SECRET, PROFILE_FORMAT,
+                    PROFILE_DIR, PROFILE_MAX_FILES, PROFILE_MAX_BYTES,
+                    READ_MODEL, READ_MODEL_REFRESH, READ_MODEL_MAX_BYTES,
+                    DATABASE_REPLICA_URLS, REPLICA_HEALTH_INTERVAL, REPLICA_STICKY_SECONDS,
+                    COMPRESSION_ENCODINGS, COMPRESSION_MIN_SIZE, COMPRESSION_GZIP_LEVEL,
+                    COMPRESSION_BROTLI_LEVEL, COMPRESSION_ZSTD_LEVEL, COMPRESSION_CACHE_SIZE)
+from flaskr import encoder
+from flaskr.encoder import jsonify
+from flaskr.quiz_sessions import create_deck_store, redis_client
+from flaskr.quiz_sampling import DIFFICULTIES, DatabaseBands, deal
+from flaskr.http_cache import ResponseCache
+from flaskr.compression import Compressor
+from flaskr.metrics import Metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from flaskr.profiler import RequestProfiler
+from flaskr.read_model import read_model
+from flaskr.replicas import ReplicaRouter
+from flaskr.search import QuestionSearch
+from flaskr.suggest import question_suggestions
+from flaskr.bulk import read_questions, insert_questions, export_questions
+from flaskr.pagination import format_questions, paginate_questions, count_questions, next_cursor
 #----------------------------------------------------------------------------#
 # New Functions
 #----------------------------------------------------------------------------#
-'''
-Questions Format
-Parameters: query of selected questions
-Return: List of questions formated as defined in models.py file
-'''
-def format_questions(selection):
-    questions_formt = [Question.format() for Question in selection]
-    return questions_formt
-
 '''
 Categories Format
 Parameters: query of selected categories
@@ -42,19 +47,109 @@ def format_categories(selection):
    return categories_formt
 
 '''
-Paginate Questions
-Parameters: HTTP request, query of selected questions 
-Return: Questions formated in list max (QUESTIONS_PER_PAGE) questions per page
+Parse Category Id
+Parameters: category id as sent by the client (int or numeric string)
+Return: category id as int, aborts with 400 if not valid
+'''
+def parse_category_id(category_id):
+    try:
+      return int(category_id)
+    except (TypeError, ValueError):
+      abort(400, {'message': 'Category id is not valid.'})
+
+'''
+Parse Quiz Count
+Parameters: number of questions asked for a quiz round, as sent by the client
+Return: count as int, aborts with 400 unless between 1 and QUIZ_BATCH_MAX
+'''
+def parse_quiz_count(count):
+    if isinstance(count, bool) or not isinstance(count, int) or not 1 <= count <= QUIZ_BATCH_MAX:
+      abort(400, {'message': 'Count must be between 1 and {}.'.format(QUIZ_BATCH_MAX)})
+    return count
+
+'''
+Parse Difficulty Curve
+Parameters: target difficulty per question of a quiz round, as sent by the client
+Return: list of ints, None if not given; aborts with 400 unless every
+        target is a difficulty of quiz_sampling.DIFFICULTIES
+'''
+def parse_difficulty_curve(curve):
+    if curve is None:
+      return None
+    if (not isinstance(curve, list) or not 1 <= len(curve) <= QUIZ_BATCH_MAX or
+        any(isinstance(target, bool) or target not in DIFFICULTIES for target in curve)):
+      abort(400, {'message': 'Difficulty curve must list difficulties between 1 and 5.'})
+    return curve
+
+'''
+Parse Difficulty Weights
+Parameters: {difficulty: weight} as sent by the client, keys may be strings
+Return: dict of int difficulty -> float weight, None if not given; aborts
+        with 400 unless weights are non-negative numbers, one of them positive
+'''
+def parse_difficulty_weights(weights):
+    if weights is None:
+      return None
+    message = {'message': 'Difficulty weights must map difficulties between 1 and 5 to non-negative numbers.'}
+    if not isinstance(weights, dict) or not weights:
+      abort(400, message)
+    parsed = {}
+    for difficulty, weight in weights.items():
+      try:
+        difficulty = int(difficulty)
+      except (TypeError, ValueError):
+        abort(400, message)
+      if (difficulty not in DIFFICULTIES or isinstance(weight, bool) or
+          not isinstance(weight, (int, float)) or weight < 0):
+        abort(400, message)
+      parsed[difficulty] = float(weight)
+    if not any(parsed.values()):
+      abort(400, message)
+    return parsed
+
+'''
+Minimal Response
+Parameters: HTTP request
+Return: True if the client asked write endpoints to answer without the
+        page of questions, with ?return=minimal or Prefer: return=minimal
 '''
-def paginate_questions(request, selection):
-    page = request.args.get('page', 1, type=int)
-    start = (page - 1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
+def wants_minimal_response(request):
+    return (request.args.get('return') == 'minimal' or
+            'return=minimal' in request.headers.get('Prefer', '').replace(' ', ''))
 
-    questions = format_questions(selection)
-    paginated_questions = questions[start:end]
+'''
+Pick Random Question
+Parameters: query of candidate questions (not yet executed)
+Return: one random Question of the query, None if the query is empty.
+        Counts the candidates, then fetches the single row at a random
+        offset instead of loading every candidate
+'''
+def pick_random_question(selection):
+    total = count_questions(selection)
+    if total == 0:
+      return None
+    return selection.order_by(Question.id).offset(random.randrange(total)).limit(1).first()
 
-    return paginated_questions
+'''
+Pick Random Questions
+Parameters: query of candidate questions (not yet executed), number of questions
+Return: up to count distinct random Questions of the query, in random order.
+        Counts the candidates, draws count distinct positions, then fetches
+        the rows at those positions in one pass over the candidates by id,
+        instead of sorting every candidate by random()
+'''
+def pick_random_questions(selection, count):
+    total = count_questions(selection)
+    if total == 0:
+      return []
+    positions = random.sample(range(1, total + 1), min(count, total))
+    numbered = (selection.order_by(None)
+                  .with_entities(Question.id, func.row_number().over(order_by=Question.id).label('position'))
+                  .subquery())
+    questions = (Question.query.join(numbered, Question.id == numbered.c.id)
+                   .filter(numbered.c.position.in_(positions)).all())
+    random.shuffle(questions)
+    return questions
 
 '''
 Display Error Default Description Msgs
@@ -73,8 +168,56 @@ def create_app(test_config=None):
   # create and configure the app
   app = Flask(__name__)
   app.secret_key = SECRET_KEY
+  app.debug = DEBUG
+  # tests pass the url of their own database
+  test_config = test_config or {}
     
-  setup_db(app)
+  setup_db(app, test_config.get('SQLALCHEMY_DATABASE_URI', database_path))
+  # only the flask command line needs the migrations (flask db upgrade)
+  if os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+    setup_migrations(app)
+  encoder.init_app(app, JSON_ENCODER)
+  quiz_sessions = create_deck_store(QUIZ_SESSION_STORE, QUIZ_SESSION_TTL, WEB_CONCURRENCY)
+  if quiz_sessions is None:
+    app.logger.warning('%d workers keep their own quiz sessions: quiz sessions are off, '
+                       'set QUIZ_SESSION_STORE to a redis:// url', WEB_CONCURRENCY)
+  question_search = QuestionSearch(SEARCH_BACKEND)
+  if DATA_VERSION_STORE != 'memory':
+    data_version.use(redis_client(DATA_VERSION_STORE))
+  # a data version kept in memory only follows the writes of this process
+  shared_version = DATA_VERSION_STORE != 'memory' or WEB_CONCURRENCY <= 1
+  if not shared_version:
+    app.logger.warning('%d workers keep their own data version: ETags and the response cache '
+                       'are off, suggestions are built again every %d seconds, set '
+                       'DATA_VERSION_STORE to a redis:// url', WEB_CONCURRENCY, SUGGEST_MAX_AGE)
+  read_model.configure(READ_MODEL, READ_MODEL_REFRESH, READ_MODEL_MAX_BYTES, shared_version)
+  question_suggestions.configure(SUGGEST_LIMIT, None if shared_version else SUGGEST_MAX_AGE)
+  replicas = ReplicaRouter(DATABASE_REPLICA_URLS, REPLICA_HEALTH_INTERVAL, REPLICA_STICKY_SECONDS)
+  replicas.init_app(app)
+  # the in-memory time of change starts again with the process, If-Modified-Since
+  # is only answered from a shared store
+  http_cache = ResponseCache(RESPONSE_CACHE_SIZE, HTTP_CACHE_MAX_AGE, enabled=shared_version,
+                             dates=DATA_VERSION_STORE != 'memory')
+  metrics = Metrics(SERVER_TIMING)
+  metrics.init_app(app)
+  # registered after metrics, so compression time counts in the latency
+  compressor = Compressor(COMPRESSION_ENCODINGS, COMPRESSION_MIN_SIZE, {
+    'gzip': COMPRESSION_GZIP_LEVEL,
+    'br': COMPRESSION_BROTLI_LEVEL,
+    'zstd': COMPRESSION_ZSTD_LEVEL
+  }, COMPRESSION_CACHE_SIZE)
+  compressor.init_app(app)
+  metrics.gauge('trivia_category_cache', 'Category cache hits, misses and size.', category_cache.stats)
+  metrics.gauge('trivia_response_cache', 'Response cache hits, misses and size.', http_cache.stats)
+  metrics.gauge('trivia_db_pool', 'Connection pool usage of this process.',
+                lambda: {key: value for key, value in pool_status().items() if key != 'pool'})
+  metrics.gauge('trivia_compression', 'Compressed responses, bytes before and after, cache hits.',
+                compressor.stats)
+  metrics.gauge('trivia_read_model', 'Question read model rows, memory and loads.', read_model.stats)
+  if PROFILE_ENABLED or PROFILE_SECRET:
+    profiler = RequestProfiler(PROFILE_DIR, PROFILE_SAMPLE_RATE, PROFILE_ENABLED, PROFILE_SECRET,
+                               PROFILE_FORMAT, PROFILE_MAX_FILES, PROFILE_MAX_BYTES)
+    profiler.init_app(app)
   '''
   @TODO: Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
   '''
@@ -89,6 +232,13 @@ def create_app(test_config=None):
     response.headers.add('Access-Control-Allow-Headers','Content-Type,Authorization,true')
     response.headers.add('Access-Control-Allow-Methods','GET,PUT,POST,DELETE,OPTIONS')
     return response
+
+  # One session per request: whatever the request left uncommitted is
+  # rolled back here, before Flask-SQLAlchemy releases the session and
+  # returns its connection to the pool.
+  @app.teardown_request
+  def release_session(error):
+    session_rollback()
   
 #----------------------------------------------------------------------------#
 # Endpoints / Routes
@@ -99,15 +249,24 @@ def create_app(test_config=None):
   for all available categories.
   '''
   @app.route('/categories', methods=['GET'])
+  @http_cache.cached
+  @replicas.reads
   def get_categories():
-    selection = Category.query.order_by(Category.id).all() 
+    categories = category_cache.mapping()
       
-    if len(selection) == 0:
+    if len(categories) == 0:
       abort(404)
+
+    if request.args.get('with_counts', '').lower() in ('1', 'true', 'yes'):
+      return jsonify({
+          'success': True,
+          'categories': categories,
+          'question_counts': category_question_counts()
+      })
          
     return jsonify({
         'success': True,
-        'categories': {category.id: category.type for category in selection }
+        'categories': categories
     })
   '''
   TEST: GET /categories
@@ -123,13 +282,16 @@ def create_app(test_config=None):
   number of total questions, current category, categories. 
   '''
   @app.route('/questions', methods=['GET'])
+  @http_cache.cached
+  @replicas.reads
   def get_questions(): 
-    selection = Question.query.order_by(Question.id).all()
-    
-    current_questions = paginate_questions(request, selection)
+    if read_model.active():
+      current_questions = read_model.paginate(request)
+      total_questions = read_model.count()
+    else:
+      current_questions = paginate_questions(request, Question.query)
+      total_questions = question_counter.total()
     
-    categories = Category.query.order_by(Category.id).all()
-      
     if not current_questions:
           abort(404)
 
@@ -137,9 +299,10 @@ def create_app(test_config=None):
     return jsonify({
         'success': True,
         'questions': current_questions,
-        'total_questions': len(selection),
+        'total_questions': total_questions,
+        'next_cursor': next_cursor(current_questions),
         'current_category': None,
-        'categories': {category.id: category.type for category in categories}
+        'categories': category_cache.mapping()
     })
   '''
   TEST: At this point, when you start the application
@@ -158,24 +321,32 @@ def create_app(test_config=None):
   '''
   @app.route('/questions/<int:question_id>', methods=['DELETE'])
   def delete_question(question_id):
-    try:
-      question = Question.query.filter(Question.id == question_id).one_or_none()
+    question = Question.query.filter(Question.id == question_id).one_or_none()
 
-      if question is None:
-          abort(404)
+    if question is None:
+        abort(404)
 
-      question.delete()
-      selection = Question.query.order_by(Question.id).all()
-      current_questions = paginate_questions(request, selection)
+    try:
+      with unit_of_work():
+        question.delete()
+    except exc.SQLAlchemyError:
+      abort(422)
 
+    if wants_minimal_response(request):
       return jsonify({
           'success': True,
           'deleted:': question_id,
-          'questions': current_questions,
-          'total_questions': len(selection)
-      })
-    except:
-      abort(422)
+          'total_questions': question_counter.total()
+      }), 200, {'Preference-Applied': 'return=minimal'}
+
+    current_questions = paginate_questions(request, Question.query)
+
+    return jsonify({
+        'success': True,
+        'deleted:': question_id,
+        'questions': current_questions,
+        'total_questions': question_counter.total()
+    })
   '''
   TEST: When you click the trash icon next to a question, the question will be removed.
   This removal will persist in the database and when you refresh the page. 
@@ -199,37 +370,40 @@ def create_app(test_config=None):
     new_category = body.get('category', None)
     new_difficulty = body.get('difficulty', None)
   
+    if new_category is not None:
+      new_category = parse_category_id(new_category)
+
     if not new_question:
       abort(400, {'message': 'Question can not be blank'})  
     elif not new_answer:
       abort(400, {'message': 'Answer can not be blank'})
     else:
+      question = Question(question = new_question, 
+                          answer = new_answer, 
+                          category = new_category,
+                          difficulty = new_difficulty)
       try:
-          question = Question(question = new_question, 
-                              answer = new_answer, 
-                              category = new_category,
-                              difficulty = new_difficulty)
-          
-          question.insert()
-          session_commit()
-          
-          
-          selection = Question.query.order_by(Question.id).all()
-          current_questions = paginate_questions(request, selection)
-          
-          return jsonify({
-              'success': True,
-              'created': question.id,
-              'questions': current_questions,
-              'total_questions': len(selection)
-          })
-          
-      except:
+          with unit_of_work():
+            question.insert()
+      except exc.SQLAlchemyError:
         flash('An error occurred due to database insertion error. Question could not be listed.')
-        # session_rollback()
         abort(400)
-      finally:
-        session_close()
+          
+      if wants_minimal_response(request):
+        return jsonify({
+            'success': True,
+            'created': question.id,
+            'total_questions': question_counter.total()
+        }), 200, {'Preference-Applied': 'return=minimal'}
+
+      current_questions = paginate_questions(request, Question.query)
+      
+      return jsonify({
+          'success': True,
+          'created': question.id,
+          'questions': current_questions,
+          'total_questions': question_counter.total()
+      })
 
   '''
   TEST: When you submit a question on the "Add" tab, 
@@ -242,31 +416,79 @@ def create_app(test_config=None):
         Fail: test_400_create_new_question
   '''
   '''
+  Bulk import: NDJSON (one question per line) or CSV (text/csv, header line)
+  read from the request body as it streams in, inserted in batches.
+  '''
+  @app.route('/questions/bulk', methods=['POST'])
+  def bulk_create_questions():
+    batch_size = min(request.args.get('batch_size', BULK_BATCH_SIZE, type=int), BULK_BATCH_SIZE * 10)
+    if batch_size < 1:
+      abort(400, {'message': 'Batch size must be positive.'})
+
+    rows = read_questions(request.stream, request.mimetype)
+    inserted, errors = insert_questions(rows, batch_size)
+    if inserted:
+      question_search.invalidate()
+
+    if not inserted and not errors:
+      abort(400, {'message': 'Please provide questions.'})
+
+    return jsonify({
+        'success': True,
+        'inserted': inserted,
+        'errors': errors,
+        'total_questions': question_counter.total()
+    })
+
+  '''
+  Export every question as NDJSON (default) or CSV (?format=csv),
+  streamed from a server-side cursor.
+  '''
+  @app.route('/questions/export', methods=['GET'])
+  @replicas.reads
+  def export_all_questions():
+    format = request.args.get('format', 'ndjson')
+    if format not in ('ndjson', 'csv'):
+      abort(400, {'message': 'Export format must be ndjson or csv.'})
+
+    mimetype = 'text/csv' if format == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(export_questions(format, EXPORT_BATCH_SIZE)),
+                    mimetype=mimetype,
+                    headers={'Content-Disposition': 'attachment; filename=questions.' + format})
+  '''
+  TEST: POST /questions/bulk, GET /questions/export
+        Pass: test_bulk_create_questions, test_export_questions
+        Fail: test_400_bulk_create_questions
+  '''
+  '''
   @TODO: 
   Create a POST endpoint to get questions based on a search term. 
   It should return any questions for whom the search term 
   is a substring of the question. 
   '''
   @app.route('/questions/search', methods=['POST'])
+  @replicas.reads
   def search_questions():
     body = request.get_json()
-    search = body.get('searchTerm', None)
-    
-    selection = Question.query.order_by(Question.id).filter(
-        Question.question.ilike('%{}%'.format(search))).all()
+    search = body.get('searchTerm', None) or ''
+    rank = body.get('rank', False)
+
+    if rank and request.args.get('cursor'):
+      abort(400, {'message': 'Ranked search is paginated with page only.'})
 
-    if len(selection) == 0:
+    total_questions, current_questions = question_search.search(request, search, rank)
+
+    if total_questions == 0:
         # abort(404, {'message': 'No questions contains "{}" found.'.format(search)})
         abort(404, {'message': 'No questions contains found.' })
     else:   
-      current_questions = paginate_questions(request, selection)
-      categories = Category.query.all()
-      current_categories = format_categories(categories)
+      current_categories = category_cache.formatted()
       
       return jsonify({
           'success': True,
           'questions': current_questions,
-          'total_questions': len(selection),
+          'total_questions': total_questions,
+          'next_cursor': None if rank else next_cursor(current_questions),
           'current_category': current_categories
         })
   '''
@@ -280,31 +502,61 @@ def create_app(test_config=None):
         Fail: test_404_search_questions
   '''
   '''
+  Suggest completions of a search term as it is typed, from the in-process
+  prefix index of the question and answer texts: no query once it is built.
+  '''
+  @app.route('/questions/suggest', methods=['GET'])
+  @replicas.reads
+  def suggest_questions():
+    prefix = request.args.get('prefix', '')
+    limit = request.args.get('limit', SUGGEST_LIMIT, type=int)
+    if not prefix.strip():
+      abort(400, {'message': 'Please provide a prefix.'})
+    if limit < 1:
+      abort(400, {'message': 'Limit must be positive.'})
+
+    return jsonify({
+      'success': True,
+      'prefix': prefix,
+      'suggestions': question_suggestions.suggest(prefix, limit)
+    })
+  '''
+  TEST: GET /questions/suggest
+        Pass: test_suggest_questions
+        Fail: test_400_suggest_questions
+  '''
+  '''
   @TODO: 
   Create a GET endpoint to get questions based on category. 
   '''
-  @app.route('/categories/<string:category_id>/questions', methods=['GET'])
+  @app.route('/categories/<int:category_id>/questions', methods=['GET'])
+  @http_cache.cached
+  @replicas.reads
   def get_questions_by_category(category_id):
-    selection = (Question.query
-                   .filter(Question.category == category_id)
-                   .order_by(Question.id)
-                   .all())
+    snapshot = read_model.active()
+    selection = Question.query.filter(Question.category == category_id)
+    total_questions = read_model.count(category_id) if snapshot else category_question_count(category_id)
       
-    current_questions = paginate_questions(request, selection)
-    current_category = Category.query.filter(
-        Category.id == int(category_id)).all()
-    if len(selection) == 0:
+    if total_questions == 0:
       # abort(400, {'message': 'No questions with category {} found.'.format(category_id)})
       abort(400, {'message': 'No questions with category id found.'})
 
+    if snapshot:
+      current_questions = read_model.paginate(request, category_id)
+    else:
+      current_questions = paginate_questions(request, selection)
+    current_category = {id: type for id, type in category_cache.mapping().items()
+                        if id == category_id}
+
     if current_questions is None:
       abort(404, {'message': 'No questions in selected page.'})
       
     return jsonify({
     'success': True,
     'questions': current_questions,
-    'total_questions': len(selection),
-        'current_category': {category.id: category.type for category in current_category}
+    'total_questions': total_questions,
+    'next_cursor': next_cursor(current_questions),
+        'current_category': current_category
                 })
 
   '''
@@ -313,7 +565,7 @@ def create_app(test_config=None):
   category to be shown. 
   '''
   '''
-  TEST: GET /categories/<string:category_id>/questions
+  TEST: GET /categories/<int:category_id>/questions
         Pass: test_get_questions_by_category
         Fail: test_400_get_questions_by_category
   '''
@@ -325,6 +577,7 @@ def create_app(test_config=None):
   if provided, and that is not one of the previous questions. 
   '''
   @app.route('/quizzes', methods=['POST'])
+  @replicas.reads
   def play_quiz():
     body = request.get_json()
     
@@ -333,25 +586,69 @@ def create_app(test_config=None):
       
     previous_questions = body.get('previous_questions', None)
     current_category = body.get('quiz_category', None)
-    
-    if not previous_questions and current_category:
-          # if no previous questions given, but category given then get any question within this category.
-          current_questions = (Question.query.filter(Question.category == str(current_category['id'])).all())
+    count = body.get('count', None)
+    if count is not None:
+      count = parse_quiz_count(count)
+    category_id = parse_category_id(current_category['id']) if current_category else None
+    curve = parse_difficulty_curve(body.get('difficulty_curve', None))
+    weights = parse_difficulty_weights(body.get('difficulty_weights', None))
+    if curve and weights:
+      abort(400, {'message': 'Send either a difficulty curve or difficulty weights.'})
+
+    if curve or weights:
+      # draw by difficulty: the round goes on from the questions already asked
+      bands = read_model.bands if read_model.active() else DatabaseBands
+      random_questions = (deal(bands(category_id), count or 1, previous_questions, curve, weights,
+                               position=len(previous_questions or ())) or
+                          deal(bands(None), count or 1, None, curve, weights))
+    elif read_model.active():
+      random_questions = (read_model.sample(category_id, previous_questions, count or 1) or
+                          read_model.sample(None, None, count or 1))
     else:
-      if current_category:
-        # if given previous questions and category, query for questions which are not contained in previous question and in given category
-        current_questions = (Question.query
-          .filter(Question.category == str(current_category['id'])).filter(Question.id.notin_(previous_questions)).all())
-      else:
-        # if given previous questions and no category, query for questions which are not contained in previous question.
-        current_questions = (Question.query.filter(Question.id.notin_(previous_questions)).all())
+      random_questions = None
+
+    if random_questions is not None:
+      if not random_questions:
+        abort(404, {'message': 'No questions available.'})
+      if count is None:
+        return jsonify({
+            'success': True,
+            'question': random_questions[0]
+        })
+      return jsonify({
+          'success': True,
+          'question': random_questions[0],
+          'questions': random_questions
+      })
     
-    if len(current_questions) > 0:
-      random_question = random.choice(current_questions) 
-    else:
-      # if no previous questions given and no category, just query any question.
-        current_questions = (Question.query.all())
-        random_question = random.choice(current_questions)
+    current_questions = Question.query
+    if current_category:
+      # if category given, only pick questions within this category.
+      current_questions = current_questions.filter(Question.category == category_id)
+    if previous_questions:
+      # if previous questions given, only pick questions which are not contained in previous questions.
+      current_questions = current_questions.filter(Question.id.notin_(previous_questions))
+
+    if count is not None:
+      # batch mode: deal a whole round of distinct questions at once
+      random_questions = pick_random_questions(current_questions, count)
+      if not random_questions:
+        random_questions = pick_random_questions(Question.query, count)
+      if not random_questions:
+        abort(404, {'message': 'No questions available.'})
+
+      return jsonify({
+          'success': True,
+          'question': random_questions[0].format(),
+          'questions': format_questions(random_questions)
+      })
+    
+    random_question = pick_random_question(current_questions)
+    if random_question is None:
+      # if no question is left, just pick any question.
+      random_question = pick_random_question(Question.query)
+    if random_question is None:
+      abort(404, {'message': 'No questions available.'})
     
     return jsonify({
         'success': True,
@@ -367,6 +664,136 @@ def create_app(test_config=None):
         Pass: test_play_quiz_with_category
         Fail: test_400_play_quiz_with_category
   '''
+  '''
+  Quiz sessions: the server keeps a shuffled deck of question ids per quiz,
+  so each round only sends the session token instead of previous_questions.
+  '''
+  @app.route('/quizzes/sessions', methods=['POST'])
+  @replicas.reads
+  def start_quiz_session():
+    if quiz_sessions is None:
+      # the next round could reach a worker that does not know the session
+      abort(503, {'message': 'Quiz sessions need a QUIZ_SESSION_STORE shared by the workers.'})
+    body = request.get_json(silent=True) or {}
+    current_category = body.get('quiz_category', None)
+
+    question_ids = Question.query.with_entities(Question.id)
+    if current_category and current_category.get('id'):
+      question_ids = question_ids.filter(Question.category == parse_category_id(current_category['id']))
+    question_ids = [row.id for row in question_ids]
+
+    if not question_ids:
+      abort(404, {'message': 'No questions available.'})
+
+    return jsonify({
+        'success': True,
+        'session': quiz_sessions.start(question_ids),
+        'total_questions': len(question_ids)
+    })
+
+  @app.route('/quizzes/sessions/<string:token>/next', methods=['POST'])
+  def next_quiz_question(token):
+    if quiz_sessions is None:
+      abort(404, {'message': 'Quiz session not found.'})
+    while True:
+      try:
+        question_id = quiz_sessions.pop(token)
+      except KeyError:
+        abort(404, {'message': 'Quiz session not found.'})
+
+      if question_id is None:
+        # deck exhausted, the quiz is over
+        return jsonify({
+            'success': True,
+            'question': None
+        })
+
+      # skip questions deleted since the session started
+      question = Question.query.get(question_id)
+      if question is not None:
+        return jsonify({
+            'success': True,
+            'question': question.format()
+        })
+
+  @app.route('/quizzes/sessions/<string:token>', methods=['DELETE'])
+  def end_quiz_session(token):
+    if quiz_sessions is not None:
+      quiz_sessions.end(token)
+    return jsonify({
+        'success': True
+    })
+  '''
+   TEST: POST '/quizzes/sessions', POST '/quizzes/sessions/<token>/next'
+        Pass: test_play_quiz_session
+        Fail: test_404_next_question_unknown_session
+  '''
+  '''
+  Database health and connection pool usage of this worker process.
+  '''
+  @app.route('/health/db', methods=['GET'])
+  def database_health():
+    try:
+      latency = ping_database()
+    except exc.SQLAlchemyError:
+      session_rollback()
+      return jsonify({
+          'success': False,
+          'database': 'unavailable',
+          'pool': pool_status(),
+          'replicas': replicas.status()
+      }), 503
+    return jsonify({
+        'success': True,
+        'database': 'ok',
+        'latency_ms': round(latency * 1000, 3),
+        'pool': pool_status(),
+        'replicas': replicas.status()
+    })
+
+  '''
+  Request, SQL and cache metrics of this worker process in the Prometheus
+  text format.
+  '''
+  @app.route('/metrics', methods=['GET'])
+  def get_metrics():
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+#----------------------------------------------------------------------------#
+# Commands
+#----------------------------------------------------------------------------#
+  '''
+  flask reconcile-counts: fix per-category question counters that drifted,
+  e.g. from cron.
+  '''
+  @app.cli.command('reconcile-counts')
+  def reconcile_counts():
+    with unit_of_work():
+      drifted = reconcile_category_counts()
+    if drifted:
+      data_version.bump()
+    for category_id, (stored, actual) in sorted(drifted.items()):
+      print('category {}: {} -> {}'.format(category_id, stored, actual))
+    print('{} categories fixed'.format(len(drifted)))
+
+  '''
+  flask init-db: create the tables of a new, empty SQLite database for
+  development and stamp it with the latest migration. Only for SQLite: the
+  migrations create indexes on Postgres (pg_trgm) that create_all does not,
+  so Postgres databases are restored from trivia.psql and brought up to
+  date with flask db upgrade.
+  '''
+  @app.cli.command('init-db')
+  def init_db():
+    import click
+    from flask_migrate import stamp
+    from sqlalchemy.engine.url import make_url
+    if make_url(app.config['SQLALCHEMY_DATABASE_URI']).get_backend_name() != 'sqlite':
+      raise click.ClickException('init-db is for SQLite; restore trivia.psql and run flask db upgrade')
+    db.create_all()
+    stamp()
+    print('tables created, stamped at the latest migration')
+
 #----------------------------------------------------------------------------#
 # Error Handlers
 #----------------------------------------------------------------------------#
@@ -407,6 +834,21 @@ def create_app(test_config=None):
         "message": get_err_msg(error, "unprocessable")
     }), 422
 
+  @app.errorhandler(exc.SQLAlchemyError)
+  def database_error(error):
+    # a failed statement leaves the transaction aborted, roll it back
+    # before the connection goes back to the pool
+    session_rollback()
+    return internal_server_error(error)
+
+  @app.errorhandler(503)
+  def service_unavailable(error):
+    return jsonify({
+        "success": False,
+        "error": 503,
+        "message": get_err_msg(error, "service unavailable")
+    }), 503
+
   @app.errorhandler(500)
   def internal_server_error(error):
     return jsonify({
@@ -0,0 +1,435 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+import random
+import time
+from http import HTTPStatus
+from databases import Database
+from sqlalchemy import select, func, and_
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response
+from starlette.routing import Route
+from werkzeug.exceptions import HTTPException, abort
+from models import database_path, Question, Category, data_version
+from config import (DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_STATEMENT_TIMEOUT, CATEGORY_CACHE_TTL,
+                    DATA_VERSION_STORE, JSON_ENCODER)
+from flaskr import parse_category_id, parse_quiz_count, get_err_msg
+from flaskr.quiz_sessions import redis_client
+from flaskr.encoder import get_encoder
+from flaskr.search import contains_pattern
+from flaskr.pagination import (QUESTIONS_PER_PAGE, QUESTION_FIELDS, QuestionPage, parse_fields,
+                               format_question_rows, decode_cursor, next_cursor)
+#----------------------------------------------------------------------------#
+# Constants
+#----------------------------------------------------------------------------#
+questions = Question.__table__
+categories = Category.__table__
+# default messages of the error responses, as in create_app
+ERROR_MESSAGES = {
+    400: 'bad request',
+    404: 'resource not found',
+    405: 'method not allowed',
+    422: 'unprocessable',
+    500: 'internal server error'
+}
+#----------------------------------------------------------------------------#
+# New Functions
+#----------------------------------------------------------------------------#
+'''
+Async Database
+Parameters: SQLAlchemy database url
+Return: databases.Database on the async driver of the url (asyncpg for
+        postgresql://, aiosqlite for sqlite://), sized like the sync pool
+'''
+def async_database(url):
+    if not url.startswith('postgres'):
+      return Database(url)
+    options = {'min_size': 1, 'max_size': DB_POOL_SIZE + DB_MAX_OVERFLOW}
+    if DB_STATEMENT_TIMEOUT:
+      options['server_settings'] = {'statement_timeout': str(DB_STATEMENT_TIMEOUT)}
+    return Database(url.replace('postgres://', 'postgresql://', 1), **options)
+
+'''
+Format Records
+Parameters: database records, fields as from pagination.parse_fields
+Return: List of questions formated as pagination.format_question_rows
+'''
+def format_records(records, fields=QUESTION_FIELDS):
+    return format_question_rows(([record[field] for field in fields] for record in records), fields)
+
+'''
+Paginate Question Rows
+Parameters: query params, select of question columns (not yet executed)
+Return: select of the requested page and of the first question after it,
+        same ?page= and ?cursor= handling as pagination.paginate_questions;
+        None for a page below 1
+'''
+def paginate_select(params, query):
+    try:
+      page = int(params.get('page', 1))
+    except ValueError:
+      page = 1
+    cursor = params.get('cursor')
+
+    query = query.order_by(questions.c.id)
+    if cursor:
+      query = query.where(questions.c.id > decode_cursor(cursor))
+    elif page < 1:
+      return None
+    else:
+      query = query.offset((page - 1) * QUESTIONS_PER_PAGE)
+    return query.limit(QUESTIONS_PER_PAGE + 1)
+
+'''
+Wants Minimal Response
+Parameters: starlette request
+Return: True for ?return=minimal or Prefer: return=minimal, as in create_app
+'''
+def wants_minimal_response(request):
+    return (request.query_params.get('return') == 'minimal' or
+            'return=minimal' in request.headers.get('Prefer', '').replace(' ', ''))
+
+async def read_json(request):
+    try:
+      return await request.json()
+    except ValueError:
+      return None
+#----------------------------------------------------------------------------#
+# API Setup
+#----------------------------------------------------------------------------#
+'''
+create_asgi_app()
+    async variant of create_app for an ASGI server, e.g.
+        uvicorn --factory flaskr.asgi:create_asgi_app
+    Serves the question, category and quiz endpoints of create_app with
+    the same JSON contract, on the tables of models.py through an async
+    driver, so a slow query holds a coroutine instead of a worker thread.
+    Bulk import, export, quiz sessions, metrics and HTTP caching stay on
+    the WSGI app.
+'''
+def create_asgi_app(database_url=database_path):
+  database = async_database(database_url)
+  is_postgres = database_url.startswith('postgres')
+  if DATA_VERSION_STORE != 'memory':
+    data_version.use(redis_client(DATA_VERSION_STORE))
+  category_cache = {'mapping': None, 'loaded_at': 0}
+  dumps = get_encoder(JSON_ENCODER)
+
+  def respond(content, status_code=200, headers=None):
+    return Response(dumps(content), status_code, headers, media_type='application/json')
+
+  async def category_mapping():
+    # categories are only written through migrations or the WSGI app,
+    # reload them once per CATEGORY_CACHE_TTL like models.category_cache
+    if (category_cache['mapping'] is None or
+        time.monotonic() - category_cache['loaded_at'] >= CATEGORY_CACHE_TTL):
+      rows = await database.fetch_all(select([categories.c.id, categories.c.type])
+                                      .order_by(categories.c.id))
+      category_cache['mapping'] = {row['id']: row['type'] for row in rows}
+      category_cache['loaded_at'] = time.monotonic()
+    return category_cache['mapping']
+
+  async def count(*where):
+    return await database.fetch_val(select([func.count(questions.c.id)]).where(and_(*where)))
+
+  async def fetch_page(request, *where):
+    fields = parse_fields(request.query_params.get('fields'))
+    query = select([questions.c[field] for field in fields]).where(and_(*where))
+    query = paginate_select(request.query_params, query)
+    if query is None:
+      return []
+    records = await database.fetch_all(query)
+    return QuestionPage(format_records(records[:QUESTIONS_PER_PAGE], fields),
+                        more=len(records) > QUESTIONS_PER_PAGE)
+
+  async def adjust_category_count(category, delta):
+    # Core writes skip the mapper events that keep the counters of models.py
+    if category is not None:
+      await database.execute(categories.update().where(categories.c.id == category)
+                             .values(question_count=categories.c.question_count + delta))
+
+  async def pick_random_question(*where):
+    total = await count(*where)
+    if total == 0:
+      return None
+    records = await database.fetch_all(select(questions.c).where(and_(*where))
+                                       .order_by(questions.c.id)
+                                       .offset(random.randrange(total)).limit(1))
+    return format_records(records)[0] if records else None
+
+  async def pick_random_questions(limit, *where):
+    # random positions among the candidates, as pick_random_questions of create_app
+    total = await count(*where)
+    if total == 0:
+      return []
+    positions = random.sample(range(1, total + 1), min(limit, total))
+    numbered = (select([questions.c.id, func.row_number().over(order_by=questions.c.id).label('position')])
+                  .where(and_(*where)).alias('numbered'))
+    records = await database.fetch_all(select(questions.c)
+                                       .select_from(questions.join(numbered, questions.c.id == numbered.c.id))
+                                       .where(numbered.c.position.in_(positions)))
+    records = list(records)
+    random.shuffle(records)
+    return format_records(records)
+
+#----------------------------------------------------------------------------#
+# Endpoints / Routes
+#----------------------------------------------------------------------------#
+  async def get_categories(request):
+    current_categories = await category_mapping()
+
+    if len(current_categories) == 0:
+      abort(404)
+
+    if request.query_params.get('with_counts', '').lower() in ('1', 'true', 'yes'):
+      rows = await database.fetch_all(select([categories.c.id, categories.c.question_count]))
+      return respond({
+          'success': True,
+          'categories': current_categories,
+          'question_counts': {row['id']: row['question_count'] for row in rows}
+      })
+
+    return respond({
+        'success': True,
+        'categories': current_categories
+    })
+
+  async def get_questions(request):
+    current_questions = await fetch_page(request)
+
+    if not current_questions:
+      abort(404)
+
+    return respond({
+        'success': True,
+        'questions': current_questions,
+        'total_questions': await count(),
+        'next_cursor': next_cursor(current_questions),
+        'current_category': None,
+        'categories': await category_mapping()
+    })
+
+  async def delete_question(request):
+    question_id = request.path_params['question_id']
+    async with database.transaction():
+      deleted = await database.fetch_one(select([questions.c.id, questions.c.category])
+                                         .where(questions.c.id == question_id))
+      if deleted is None:
+        abort(404)
+      await database.execute(questions.delete().where(questions.c.id == question_id))
+      await adjust_category_count(deleted['category'], -1)
+    data_version.bump()
+
+    if wants_minimal_response(request):
+      return respond({
+          'success': True,
+          'deleted:': question_id,
+          'total_questions': await count()
+      }, headers={'Preference-Applied': 'return=minimal'})
+
+    return respond({
+        'success': True,
+        'deleted:': question_id,
+        'questions': await fetch_page(request),
+        'total_questions': await count()
+    })
+
+  async def create_question(request):
+    body = await read_json(request) or {}
+    new_question = body.get('question', None)
+    new_answer = body.get('answer', None)
+    new_category = body.get('category', None)
+    new_difficulty = body.get('difficulty', None)
+
+    if new_category is not None:
+      new_category = parse_category_id(new_category)
+
+    if not new_question:
+      abort(400, {'message': 'Question can not be blank'})
+    elif not new_answer:
+      abort(400, {'message': 'Answer can not be blank'})
+
+    query = questions.insert().values(question=new_question, answer=new_answer,
+                                      category=new_category, difficulty=new_difficulty)
+    if is_postgres:
+      query = query.returning(questions.c.id)
+    async with database.transaction():
+      created = await database.execute(query)
+      await adjust_category_count(new_category, 1)
+    data_version.bump()
+
+    if wants_minimal_response(request):
+      return respond({
+          'success': True,
+          'created': created,
+          'total_questions': await count()
+      }, headers={'Preference-Applied': 'return=minimal'})
+
+    return respond({
+        'success': True,
+        'created': created,
+        'questions': await fetch_page(request),
+        'total_questions': await count()
+    })
+
+  async def search_questions(request):
+    body = await read_json(request) or {}
+    search = body.get('searchTerm', None) or ''
+
+    if body.get('rank', False):
+      abort(400, {'message': 'Ranked search is served by the WSGI app only.'})
+
+    where = questions.c.question.ilike(contains_pattern(search), escape='\\')
+    total_questions = await count(where)
+
+    if total_questions == 0:
+      abort(404, {'message': 'No questions contains found.'})
+
+    current_questions = await fetch_page(request, where)
+    current_categories = await category_mapping()
+
+    return respond({
+        'success': True,
+        'questions': current_questions,
+        'total_questions': total_questions,
+        'next_cursor': next_cursor(current_questions),
+        'current_category': [{'id': id, 'type': type} for id, type in current_categories.items()]
+    })
+
+  async def get_questions_by_category(request):
+    category_id = request.path_params['category_id']
+    where = questions.c.category == category_id
+    total_questions = await database.fetch_val(select([categories.c.question_count])
+                                               .where(categories.c.id == category_id)) or 0
+
+    if total_questions == 0:
+      abort(400, {'message': 'No questions with category id found.'})
+
+    current_questions = await fetch_page(request, where)
+    current_category = {id: type for id, type in (await category_mapping()).items()
+                        if id == category_id}
+
+    return respond({
+        'success': True,
+        'questions': current_questions,
+        'total_questions': total_questions,
+        'next_cursor': next_cursor(current_questions),
+        'current_category': current_category
+    })
+
+  async def play_quiz(request):
+    body = await read_json(request)
+
+    if not body:
+      abort(400, {'message': 'Please provide quiz data.'})
+
+    if body.get('difficulty_curve') is not None or body.get('difficulty_weights') is not None:
+      abort(400, {'message': 'Difficulty curves and weights are served by the WSGI app only.'})
+
+    previous_questions = body.get('previous_questions', None)
+    current_category = body.get('quiz_category', None)
+    count = body.get('count', None)
+    if count is not None:
+      count = parse_quiz_count(count)
+
+    where = []
+    if current_category:
+      where.append(questions.c.category == parse_category_id(current_category['id']))
+    if previous_questions:
+      where.append(questions.c.id.notin_(previous_questions))
+
+    if count is not None:
+      random_questions = (await pick_random_questions(count, *where) or
+                          await pick_random_questions(count))
+      if not random_questions:
+        abort(404, {'message': 'No questions available.'})
+
+      return respond({
+          'success': True,
+          'question': random_questions[0],
+          'questions': random_questions
+      })
+
+    random_question = await pick_random_question(*where)
+    if random_question is None:
+      # if no question is left, just pick any question.
+      random_question = await pick_random_question()
+    if random_question is None:
+      abort(404, {'message': 'No questions available.'})
+
+    return respond({
+        'success': True,
+        'question': random_question
+    })
+
+  async def database_health(request):
+    start = time.perf_counter()
+    try:
+      await database.fetch_val('SELECT 1')
+    except Exception:
+      return respond({
+          'success': False,
+          'database': 'unavailable'
+      }, status_code=503)
+    return respond({
+        'success': True,
+        'database': 'ok',
+        'latency_ms': round((time.perf_counter() - start) * 1000, 3)
+    })
+
+#----------------------------------------------------------------------------#
+# Error Handlers
+#----------------------------------------------------------------------------#
+  # routes abort() like the Flask app; starlette raises its own 404 and 405
+  async def http_error(request, error):
+    code = error.code
+    return respond({
+        'success': False,
+        'error': code,
+        'message': get_err_msg(error, ERROR_MESSAGES.get(code, error.name.lower()))
+    }, status_code=code)
+
+  async def starlette_error(request, error):
+    code = error.status_code
+    message = error.detail
+    if message == HTTPStatus(code).phrase:
+      message = ERROR_MESSAGES.get(code, message)
+    return respond({
+        'success': False,
+        'error': code,
+        'message': message
+    }, status_code=code)
+
+  async def internal_server_error(request, error):
+    return respond({
+        'success': False,
+        'error': 500,
+        'message': ERROR_MESSAGES[500]
+    }, status_code=500)
+
+  return Starlette(
+      routes=[
+          Route('/categories', get_categories, methods=['GET']),
+          Route('/questions', get_questions, methods=['GET']),
+          Route('/questions', create_question, methods=['POST']),
+          Route('/questions/{question_id:int}', delete_question, methods=['DELETE']),
+          Route('/questions/search', search_questions, methods=['POST']),
+          Route('/categories/{category_id:int}/questions', get_questions_by_category, methods=['GET']),
+          Route('/quizzes', play_quiz, methods=['POST']),
+          Route('/health/db', database_health, methods=['GET'])
+      ],
+      middleware=[
+          Middleware(CORSMiddleware, allow_origins=['*'],
+                     allow_methods=['GET', 'PUT', 'POST', 'DELETE', 'OPTIONS'],
+                     allow_headers=['Content-Type', 'Authorization'])
+      ],
+      exception_handlers={
+          HTTPException: http_error,
+          StarletteHTTPException: starlette_error,
+          Exception: internal_server_error
+      },
+      on_startup=[database.connect],
+      on_shutdown=[database.disconnect])
@@ -0,0 +1,163 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+import csv
+import io
+import json
+import logging
+from sqlalchemy import exc
+from models import db, Question, unit_of_work
+#----------------------------------------------------------------------------#
+# Constants
+#----------------------------------------------------------------------------#
+EXPORT_FIELDS = ['id', 'question', 'answer', 'category', 'difficulty']
+logger = logging.getLogger(__name__)
+#----------------------------------------------------------------------------#
+# Bulk Import
+#----------------------------------------------------------------------------#
+'''
+Read Questions
+Parameters: binary stream of the request body, mimetype of the body
+            ('text/csv' with a header line, otherwise NDJSON)
+Return: generator of (line number, question dict or None, error message or None),
+        reading the body line by line
+'''
+def read_questions(stream, mimetype):
+    undecodable = []
+    lines = decode_lines(stream, undecodable)
+    if mimetype == 'text/csv':
+      reader = csv.DictReader(lines)
+      for row in reader:
+        yield from undecodable_errors(undecodable)
+        yield (reader.line_num,) + validate_question(row)
+    else:
+      for line_number, line in enumerate(lines, start=1):
+        yield from undecodable_errors(undecodable)
+        if not line.strip():
+          continue
+        try:
+          row = json.loads(line)
+        except ValueError:
+          yield line_number, None, 'Line is not valid JSON.'
+          continue
+        if not isinstance(row, dict):
+          yield line_number, None, 'Line is not a JSON object.'
+          continue
+        yield (line_number,) + validate_question(row)
+    yield from undecodable_errors(undecodable)
+
+'''
+Decode Lines
+Parameters: binary lines, list collecting the numbers of the lines that are
+            not valid UTF-8
+Return: generator of the lines as text, a line that is not valid UTF-8
+        read as an empty one
+'''
+def decode_lines(stream, undecodable):
+    for line_number, line in enumerate(stream, start=1):
+      try:
+        yield line.decode('utf-8')
+      except UnicodeDecodeError:
+        undecodable.append(line_number)
+        yield '\n'
+
+def undecodable_errors(undecodable):
+    while undecodable:
+      yield undecodable.pop(0), None, 'Line is not valid UTF-8.'
+
+'''
+Validate Question
+Parameters: dict with question, answer, category and difficulty
+Return: (question mapping, None) if valid, (None, error message) otherwise
+'''
+def validate_question(row):
+    if not row.get('question'):
+      return None, 'Question can not be blank'
+    if not row.get('answer'):
+      return None, 'Answer can not be blank'
+    try:
+      category = int(row['category']) if row.get('category') not in (None, '') else None
+    except (TypeError, ValueError):
+      return None, 'Category id is not valid.'
+    try:
+      difficulty = int(row['difficulty']) if row.get('difficulty') not in (None, '') else None
+    except (TypeError, ValueError):
+      return None, 'Difficulty is not valid.'
+    return {
+      'question': row['question'],
+      'answer': row['answer'],
+      'category': category,
+      'difficulty': difficulty
+    }, None
+
+'''
+Insert Questions
+Parameters: rows from read_questions, number of questions per batch
+Return: number of inserted questions, list of errors ({'line', 'message'})
+        Each batch is inserted with one executemany and committed; a batch
+        the database rejects is retried row by row to report the failing rows
+'''
+def insert_questions(rows, batch_size):
+    inserted = 0
+    errors = []
+    batch = []
+    for line_number, question, error in rows:
+      if error:
+        errors.append({'line': line_number, 'message': error})
+        continue
+      batch.append((line_number, question))
+      if len(batch) >= batch_size:
+        inserted += _insert_batch(batch, errors)
+        batch = []
+    if batch:
+      inserted += _insert_batch(batch, errors)
+    return inserted, errors
+
+def _insert_batch(batch, errors):
+    try:
+      with unit_of_work():
+        Question.bulk_insert([question for _, question in batch])
+      return len(batch)
+    except exc.SQLAlchemyError:
+      pass
+
+    inserted = 0
+    for line_number, question in batch:
+      try:
+        with unit_of_work():
+          Question.bulk_insert([question])
+        inserted += 1
+      except exc.SQLAlchemyError as error:
+        # the driver message names tables and constraints, keep it in the logs
+        logger.warning('Bulk import line %d rejected: %s', line_number,
+                       getattr(error, 'orig', None) or error)
+        errors.append({'line': line_number, 'message': 'Question could not be saved.'})
+    return inserted
+#----------------------------------------------------------------------------#
+# Export
+#----------------------------------------------------------------------------#
+'''
+Export Questions
+Parameters: 'ndjson' or 'csv', number of rows fetched per round trip
+Return: generator of text chunks with every question ordered by id, read
+        from a server-side cursor so memory does not grow with the table
+'''
+def export_questions(format, batch_size):
+    rows = (db.session.query(*[getattr(Question, field) for field in EXPORT_FIELDS])
+              .order_by(Question.id)
+              .execution_options(stream_results=True)
+              .yield_per(batch_size))
+    if format == 'csv':
+      buffer = io.StringIO()
+      writer = csv.writer(buffer)
+      writer.writerow(EXPORT_FIELDS)
+      for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= 64 * 1024:
+          yield buffer.getvalue()
+          buffer.seek(0)
+          buffer.truncate()
+      yield buffer.getvalue()
+    else:
+      for row in rows:
+        yield json.dumps(dict(zip(EXPORT_FIELDS, row))) + '\n'
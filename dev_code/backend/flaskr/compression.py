@@ -0,0 +1,155 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+import threading
+import zlib
+from collections import OrderedDict
+from flask import request
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+#----------------------------------------------------------------------------#
+# Constants
+#----------------------------------------------------------------------------#
+# mimetypes worth compressing, binary formats are already compact
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/plain', 'text/html')
+#----------------------------------------------------------------------------#
+# Codecs
+#----------------------------------------------------------------------------#
+'''
+Codecs compress a whole body at a level. gzip is built with zlib rather
+than the gzip module, whose header carries a timestamp, so one body always
+compresses to the same bytes.
+'''
+def gzip_compress(body, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(body) + compressor.flush()
+
+def brotli_compress(body, level):
+    return brotli.compress(body, quality=level)
+
+def zstd_compress(body, level):
+    return zstandard.ZstdCompressor(level=level).compress(body)
+
+
+CODECS = {
+    'gzip': gzip_compress,
+    'br': brotli_compress,
+    'zstd': zstd_compress
+}
+
+'''
+Available Encodings
+Parameters: encodings in order of preference
+Return: the encodings whose codec can be imported, in the same order
+'''
+def available_encodings(encodings):
+    missing = {'br': brotli is None, 'zstd': zstandard is None}
+    unknown = set(encodings) - set(CODECS)
+    if unknown:
+      raise ValueError('Unknown compression encodings: {}'.format(', '.join(sorted(unknown))))
+    return [encoding for encoding in encodings if not missing.get(encoding)]
+#----------------------------------------------------------------------------#
+# Response Compression
+#----------------------------------------------------------------------------#
+'''
+Compressor
+    compresses the body of responses for clients that accept it:
+    - the encoding is negotiated from Accept-Encoding: the highest quality
+      value wins, ties go to the first of encodings (zstd and br are used
+      only when the zstandard and brotli packages are installed)
+    - bodies below min_size bytes, streamed responses and mimetypes that
+      are not COMPRESSIBLE_MIMETYPES are sent as they are
+    - responses with an ETag (the cached GET endpoints) keep their
+      compressed bodies, per body and encoding, evicting the least recently
+      used one beyond max_entries, so an unchanged page is compressed once.
+      Their ETag becomes weak, as the bytes differ per encoding
+'''
+class Compressor:
+
+  def __init__(self, encodings=('zstd', 'br', 'gzip'), min_size=1024, levels=None,
+               max_entries=256):
+    self.encodings = available_encodings(encodings)
+    self.min_size = min_size
+    self.levels = dict({'gzip': 6, 'br': 4, 'zstd': 3}, **(levels or {}))
+    self.max_entries = max_entries
+    self.compressed = 0
+    self.bytes_in = 0
+    self.bytes_out = 0
+    self.hits = 0
+    self.misses = 0
+    self._bodies = OrderedDict()
+    self._lock = threading.Lock()
+
+  def init_app(self, app):
+    if self.encodings:
+      app.after_request(self.compress)
+
+  def negotiate(self, accept_encodings):
+    '''preferred encoding of an Accept header, None for identity'''
+    best, best_quality = None, 0
+    for encoding in self.encodings:
+      quality = accept_encodings.quality(encoding)
+      if quality > best_quality:
+        best, best_quality = encoding, quality
+    return best
+
+  def compress(self, response):
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES and response.status_code != 304:
+      return response
+    response.vary.add('Accept-Encoding')
+    if (response.direct_passthrough or response.is_streamed or
+        response.status_code < 200 or response.status_code in (204, 304) or
+        'Content-Encoding' in response.headers):
+      return response
+    encoding = self.negotiate(request.accept_encodings)
+    if encoding is None:
+      return response
+    body = response.get_data()
+    if len(body) < self.min_size:
+      return response
+
+    etag, weak = response.get_etag()
+    compressed = self._compressed(body, encoding, cache=etag is not None)
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    if etag is not None and not weak:
+      response.set_etag(etag, weak=True)
+    with self._lock:
+      self.compressed += 1
+      self.bytes_in += len(body)
+      self.bytes_out += len(compressed)
+    return response
+
+  def stats(self):
+    return {
+      'compressed': self.compressed,
+      'bytes_in': self.bytes_in,
+      'bytes_out': self.bytes_out,
+      'hits': self.hits,
+      'misses': self.misses,
+      'size': len(self._bodies)
+    }
+
+  def _compressed(self, body, encoding, cache):
+    if not cache or self.max_entries <= 0:
+      return CODECS[encoding](body, self.levels[encoding])
+    key = (body, encoding)
+    with self._lock:
+      compressed = self._bodies.get(key)
+      if compressed is not None:
+        self.hits += 1
+        self._bodies.move_to_end(key)
+        return compressed
+      self.misses += 1
+    compressed = CODECS[encoding](body, self.levels[encoding])
+    with self._lock:
+      self._bodies[key] = compressed
+      while len(self._bodies) > self.max_entries:
+        self._bodies.popitem(last=False)
+    return compressed
@@ -0,0 +1,65 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+import json
+from flask import current_app
+try:
+    import orjson
+except ImportError:
+    orjson = None
+#----------------------------------------------------------------------------#
+# JSON Encoders
+#----------------------------------------------------------------------------#
+'''
+JSON encoders turn a response payload into UTF-8 bytes. Keys are sorted
+and separators compact, as flask.jsonify does, so responses are the same
+whichever encoder is configured. Categories are keyed by int ids, which
+every encoder has to accept.
+'''
+def stdlib_dumps(data):
+    return json.dumps(data, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+def orjson_dumps(data):
+    return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS)
+
+
+ENCODERS = {
+    'stdlib': stdlib_dumps,
+    'orjson': orjson_dumps
+}
+
+'''
+Get Encoder
+Parameters: encoder name: 'stdlib', 'orjson', or 'auto' for orjson when
+            it is installed and the standard library otherwise
+Return: function of a payload returning its JSON bytes
+'''
+def get_encoder(name='auto'):
+    if name == 'auto':
+      name = 'orjson' if orjson is not None else 'stdlib'
+    if name == 'orjson' and orjson is None:
+      raise ImportError('JSON_ENCODER is orjson, but orjson is not installed')
+    try:
+      return ENCODERS[name]
+    except KeyError:
+      raise ValueError('Unknown JSON encoder: {}'.format(name))
+
+'''
+Init App
+Parameters: flask app, encoder name as for get_encoder
+Return: None, jsonify of this module serializes with the encoder
+'''
+def init_app(app, name='auto'):
+    app.extensions['json_dumps'] = get_encoder(name)
+
+'''
+JSONify
+Parameters: payload as for flask.jsonify, a dict or keyword arguments
+Return: application/json response serialized by the encoder of the app
+'''
+def jsonify(*args, **kwargs):
+    if args and kwargs:
+      raise TypeError('jsonify() behavior undefined when passed both args and kwargs')
+    data = args[0] if len(args) == 1 else (args or kwargs)
+    return current_app.response_class(current_app.extensions['json_dumps'](data) + b'\n',
+                                      mimetype=current_app.config['JSONIFY_MIMETYPE'])
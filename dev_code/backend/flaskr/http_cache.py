@@ -0,0 +1,112 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+import calendar
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from functools import wraps
+from flask import request, current_app
+from models import data_version
+#----------------------------------------------------------------------------#
+# HTTP Response Cache
+#----------------------------------------------------------------------------#
+'''
+ResponseCache
+    conditional GET and HTTP cache headers for read endpoints, driven by
+    models.data_version:
+    - every response gets ETag and Cache-Control headers; the ETag names
+      the epoch of the data version too, so a version counted again after
+      a restart does not match the ETags sent before it
+    - with dates (a data version shared by every process, which keeps its
+      time of change across restarts), responses also get Last-Modified
+      once the second of the last change is over, so every later change
+      falls in a later second
+    - If-None-Match / If-Modified-Since that still match the current data
+      version are answered with 304 without running the view; ETags are
+      compared weakly, so the weak ETag of a compressed body matches too
+    - serialized bodies are kept per url and data version, evicting the
+      least recently used entry beyond max_entries (0 disables it)
+    Disabled (enabled=False), views are left as they are: no validators,
+    no 304 and no cached bodies, for when the data version does not see
+    every write.
+'''
+class ResponseCache:
+
+  def __init__(self, max_entries=256, max_age=0, enabled=True, dates=False):
+    self.max_entries = max_entries
+    self.max_age = max_age
+    self.enabled = enabled
+    self.dates = dates
+    self.hits = 0
+    self.misses = 0
+    self._bodies = OrderedDict()
+    self._lock = threading.Lock()
+
+  def cached(self, view):
+    '''decorator for GET views returning JSON'''
+    if not self.enabled:
+      return view
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+      version, changed_at = data_version.validator()
+      url = request.full_path
+      etag = '{}-{:08x}'.format(version, zlib.crc32(url.encode('utf-8')))
+
+      if request.if_none_match:
+        not_modified = request.if_none_match.contains_weak(etag)
+      else:
+        not_modified = (self.dates and request.if_modified_since is not None and
+                        calendar.timegm(request.if_modified_since.utctimetuple()) >= int(changed_at))
+      if not_modified:
+        return self._headers(current_app.response_class(status=304), etag, changed_at)
+
+      body = self._get((url, version))
+      if body is None:
+        response = current_app.make_response(view(*args, **kwargs))
+        if response.status_code != 200:
+          return response
+        body = response.get_data()
+        self._put((url, version), body)
+      response = current_app.response_class(body, mimetype='application/json')
+      return self._headers(response, etag, changed_at)
+    return wrapper
+
+  def stats(self):
+    return {
+      'enabled': int(self.enabled),
+      'hits': self.hits,
+      'misses': self.misses,
+      'size': len(self._bodies),
+      'max_entries': self.max_entries
+    }
+
+  def _headers(self, response, etag, changed_at):
+    response.set_etag(etag)
+    if self.dates and int(changed_at) < int(time.time()):
+      response.last_modified = int(changed_at)
+    response.cache_control.public = True
+    response.cache_control.max_age = self.max_age
+    response.cache_control.must_revalidate = True
+    return response
+
+  def _get(self, key):
+    with self._lock:
+      body = self._bodies.get(key)
+      if body is None:
+        self.misses += 1
+        return None
+      self.hits += 1
+      self._bodies.move_to_end(key)
+      return body
+
+  def _put(self, key, body):
+    if self.max_entries <= 0:
+      return
+    with self._lock:
+      self._bodies[key] = body
+      self._bodies.move_to_end(key)
+      while len(self._bodies) > self.max_entries:
+        self._bodies.popitem(last=False)
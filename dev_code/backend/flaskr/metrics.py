@@ -0,0 +1,167 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+import threading
+import time
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+#----------------------------------------------------------------------------#
+# Constants
+#----------------------------------------------------------------------------#
+# histogram bucket upper bounds, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+#----------------------------------------------------------------------------#
+# Metric Types
+#----------------------------------------------------------------------------#
+'''
+Format Labels
+Parameters: tuple of (name, value) pairs
+Return: Prometheus label set, e.g. {endpoint="get_questions",method="GET"}
+'''
+def format_labels(labels):
+    if not labels:
+      return ''
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for name, value in labels) + '}'
+
+'''
+Counter
+    monotonically increasing value per label set
+'''
+class Counter:
+
+  def __init__(self, name, help):
+    self.name = name
+    self.help = help
+    self._series = {}
+
+  def inc(self, labels, value=1):
+    self._series[labels] = self._series.get(labels, 0) + value
+
+  def render(self):
+    lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} counter'.format(self.name)]
+    for labels, value in sorted(self._series.items()):
+      lines.append('{}{} {}'.format(self.name, format_labels(labels), value))
+    return lines
+
+'''
+Histogram
+    cumulative-bucket histogram per label set
+'''
+class Histogram:
+
+  def __init__(self, name, help):
+    self.name = name
+    self.help = help
+    self._series = {}
+
+  def observe(self, labels, value):
+    buckets, total, count = self._series.get(labels, ([0] * len(BUCKETS), 0.0, 0))
+    for i, bound in enumerate(BUCKETS):
+      if value <= bound:
+        buckets[i] += 1
+    self._series[labels] = (buckets, total + value, count + 1)
+
+  def render(self):
+    lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} histogram'.format(self.name)]
+    for labels, (buckets, total, count) in sorted(self._series.items()):
+      for bound, bucket in zip(BUCKETS, buckets):
+        lines.append('{}_bucket{} {}'.format(self.name, format_labels(labels + (('le', bound),)), bucket))
+      lines.append('{}_bucket{} {}'.format(self.name, format_labels(labels + (('le', '+Inf'),)), count))
+      lines.append('{}_sum{} {}'.format(self.name, format_labels(labels), total))
+      lines.append('{}_count{} {}'.format(self.name, format_labels(labels), count))
+    return lines
+#----------------------------------------------------------------------------#
+# Request Instrumentation
+#----------------------------------------------------------------------------#
+'''
+Metrics
+    per endpoint request latency, SQL statement count and database time of
+    this process, rendered in the Prometheus text format by render().
+    init_app(app) times every request and adds a Server-Timing header;
+    SQL statements are counted through SQLAlchemy engine events.
+    Gauges registered with gauge(name, help, function) are read at render.
+'''
+class Metrics:
+
+  def __init__(self, server_timing=True):
+    self.server_timing = server_timing
+    self.requests = Counter('trivia_requests_total', 'Requests by endpoint, method and status.')
+    self.latency = Histogram('trivia_request_duration_seconds', 'Request latency by endpoint.')
+    self.statements = Counter('trivia_db_statements_total', 'SQL statements executed by endpoint.')
+    self.db_time = Histogram('trivia_db_duration_seconds', 'Database time per request by endpoint.')
+    self._gauges = []
+    self._lock = threading.Lock()
+
+  def init_app(self, app):
+    app.before_request(self._start)
+    app.after_request(self._finish)
+
+  def gauge(self, name, help, function):
+    '''function returns a number, or a dict of {label value: number} for
+    a gauge with a single "name" label'''
+    self._gauges.append((name, help, function))
+
+  def render(self):
+    with self._lock:
+      lines = (self.requests.render() + self.latency.render() +
+               self.statements.render() + self.db_time.render())
+    for name, help, function in self._gauges:
+      lines += ['# HELP {} {}'.format(name, help), '# TYPE {} gauge'.format(name)]
+      value = function()
+      if isinstance(value, dict):
+        lines += ['{}{} {}'.format(name, format_labels((('name', key),)), number)
+                  for key, number in sorted(value.items())]
+      else:
+        lines.append('{} {}'.format(name, value))
+    return '\n'.join(lines) + '\n'
+
+  def _start(self):
+    g.metrics_start = time.perf_counter()
+    g.db_statements = 0
+    g.db_time = 0.0
+
+  def _finish(self, response):
+    start = g.pop('metrics_start', None)
+    if start is None:
+      return response
+    elapsed = time.perf_counter() - start
+    endpoint = request.endpoint or 'unmatched'
+    with self._lock:
+      self.requests.inc((('endpoint', endpoint), ('method', request.method),
+                         ('status', response.status_code)))
+      self.latency.observe((('endpoint', endpoint),), elapsed)
+      self.statements.inc((('endpoint', endpoint),), g.db_statements)
+      self.db_time.observe((('endpoint', endpoint),), g.db_time)
+    if self.server_timing:
+      response.headers.add('Server-Timing', 'db;dur={:.3f};desc="{} queries", app;dur={:.3f}'.format(
+          g.db_time * 1000, g.db_statements, elapsed * 1000))
+    return response
+
+
+'''
+Count every SQL statement and its time against the current request, for
+all engines.
+'''
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('metrics_query_start')
+    if not starts:
+      return
+    elapsed = time.perf_counter() - starts.pop()
+    if has_request_context() and 'db_statements' in g:
+      g.db_statements += 1
+      g.db_time += elapsed
+
+def _handle_error(context):
+    starts = context.connection.info.get('metrics_query_start') if context.connection else None
+    if starts:
+      starts.pop()
+
+event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+event.listen(Engine, 'handle_error', _handle_error)
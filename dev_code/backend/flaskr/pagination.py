@@ -0,0 +1,166 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+import base64
+import binascii
+from bisect import bisect_right
+from flask import abort
+from sqlalchemy import func
+from models import db, Question
+#----------------------------------------------------------------------------#
+# Constants
+#----------------------------------------------------------------------------#
+QUESTIONS_PER_PAGE = 10
+# fields of a question in responses, as Question.format()
+QUESTION_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+# ids are a 32-bit integer column, a cursor beyond it would overflow the query
+MAX_QUESTION_ID = 2 ** 31
+#----------------------------------------------------------------------------#
+# Pagination
+#----------------------------------------------------------------------------#
+'''
+Questions Format
+Parameters: query of selected questions
+Return: List of questions formated as defined in models.py file
+'''
+def format_questions(selection):
+    questions_formt = [Question.format() for Question in selection]
+    return questions_formt
+
+'''
+Parse Fields
+Parameters: value of the ?fields= argument, comma separated question fields
+Return: tuple of the requested QUESTION_FIELDS, all of them when empty.
+        id is always included, pagination cursors point at it. Aborts
+        with 400 on an unknown field
+'''
+def parse_fields(value):
+    if not value:
+      return QUESTION_FIELDS
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in QUESTION_FIELDS]
+    if unknown:
+      abort(400, {'message': 'Unknown question fields: {}.'.format(', '.join(unknown))})
+    return tuple(field for field in QUESTION_FIELDS if field == 'id' or field in fields)
+
+'''
+Format Question Rows
+Parameters: rows of the columns of fields, fields as from parse_fields
+Return: List of questions formated as Question.format(), limited to fields,
+        built from plain rows without loading Question objects
+'''
+def format_question_rows(rows, fields=QUESTION_FIELDS):
+    questions = [dict(zip(fields, row)) for row in rows]
+    if 'category' in fields:
+      # kept a string, as Question.format() does
+      for question in questions:
+        if question['category'] is not None:
+          question['category'] = str(question['category'])
+    return questions
+
+'''
+QuestionPage
+    questions of a page, as a list; more tells whether questions follow
+    the page, for next_cursor. Paginators fetch one question past the
+    page to know
+'''
+class QuestionPage(list):
+
+  def __init__(self, questions, more=False):
+    super().__init__(questions)
+    self.more = more
+
+'''
+Paginate Questions
+Parameters: HTTP request, query of selected questions (not yet executed)
+Return: QuestionPage of max (QUESTIONS_PER_PAGE) questions.
+        Only the requested page is fetched from the database, either with
+        LIMIT/OFFSET for ?page= or with a keyset on Question.id for ?cursor=,
+        and only the columns of the ?fields= projection
+'''
+def paginate_questions(request, selection):
+    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor', None)
+    fields = parse_fields(request.args.get('fields'))
+
+    selection = selection.with_entities(*[getattr(Question, field) for field in fields])
+    selection = selection.order_by(Question.id)
+    if cursor:
+        selection = selection.filter(Question.id > decode_cursor(cursor))
+    elif page < 1:
+        return []
+    else:
+        selection = selection.offset((page - 1) * QUESTIONS_PER_PAGE)
+
+    rows = selection.limit(QUESTIONS_PER_PAGE + 1).all()
+    paginated_questions = QuestionPage(format_question_rows(rows[:QUESTIONS_PER_PAGE], fields),
+                                       more=len(rows) > QUESTIONS_PER_PAGE)
+
+    return paginated_questions
+
+'''
+Count Questions
+Parameters: query of selected questions (not yet executed)
+Return: number of questions matching the query, as a single COUNT(*) query
+'''
+def count_questions(selection):
+    return selection.order_by(None).with_entities(func.count(Question.id)).scalar()
+
+'''
+Pagination Cursors
+encode_cursor: opaque token pointing after the given question id
+decode_cursor: question id from a token, aborts with 400 if not valid or
+               not an id the integer column can hold
+next_cursor: token for the page after the given QuestionPage, None on the
+             last page
+'''
+def encode_cursor(question_id):
+    token = base64.urlsafe_b64encode(str(question_id).encode('ascii'))
+    return token.decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+      padding = '=' * (-len(cursor) % 4)
+      question_id = int(base64.urlsafe_b64decode(cursor + padding).decode('ascii'))
+    except (ValueError, TypeError, UnicodeDecodeError, binascii.Error):
+      question_id = None
+    if question_id is None or not 0 < question_id < MAX_QUESTION_ID:
+      abort(400, {'message': 'Invalid pagination cursor.'})
+    return question_id
+
+def next_cursor(questions):
+    if not getattr(questions, 'more', False):
+      return None
+    return encode_cursor(questions[-1]['id'])
+
+'''
+Paginate Question Ids
+Parameters: HTTP request, list of matching question ids in display order
+            (ascending ids unless the list is ranked)
+Return: QuestionPage of the requested page, same ?page= and
+        ?cursor= handling as paginate_questions. Only the ids of the page
+        are fetched from the database
+'''
+def paginate_question_ids(request, question_ids):
+    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor', None)
+    fields = parse_fields(request.args.get('fields'))
+
+    if cursor:
+        start = bisect_right(question_ids, decode_cursor(cursor))
+    elif page < 1:
+        return []
+    else:
+        start = (page - 1) * QUESTIONS_PER_PAGE
+    page_ids = question_ids[start:start + QUESTIONS_PER_PAGE]
+    if not page_ids:
+        return []
+
+    rows = db.session.query(*[getattr(Question, field) for field in fields]) \
+                     .filter(Question.id.in_(page_ids))
+    questions = {question['id']: question for question in format_question_rows(rows, fields)}
+    paginated_questions = QuestionPage([questions[question_id] for question_id in page_ids
+                                        if question_id in questions],
+                                       more=start + QUESTIONS_PER_PAGE < len(question_ids))
+
+    return paginated_questions
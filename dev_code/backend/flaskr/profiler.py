@@ -0,0 +1,200 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+import cProfile
+import itertools
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from flask import g, request
+from itsdangerous import TimestampSigner, BadSignature
+#----------------------------------------------------------------------------#
+# Constants
+#----------------------------------------------------------------------------#
+HEADER = 'X-Profile'
+# seconds a signed X-Profile header stays valid
+SIGNATURE_MAX_AGE = 600
+# seconds between two stack samples in collapsed mode
+SAMPLE_INTERVAL = 0.005
+#----------------------------------------------------------------------------#
+# Request Profiler
+#----------------------------------------------------------------------------#
+'''
+StackSampler
+    samples the stack of one thread from a background thread, for
+    collapsed-stack (flame graph) output: "outer;inner;leaf count" lines
+'''
+class StackSampler:
+
+  def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+    self.thread_id = thread_id
+    self.interval = interval
+    self.stacks = Counter()
+    self._stopped = threading.Event()
+    self._thread = threading.Thread(target=self._run, daemon=True)
+
+  def start(self):
+    self._thread.start()
+
+  def stop(self):
+    self._stopped.set()
+    self._thread.join()
+
+  def dump(self, path):
+    with open(path, 'w') as f:
+      for stack, count in self.stacks.most_common():
+        f.write('{} {}\n'.format(stack, count))
+
+  def _run(self):
+    while not self._stopped.wait(self.interval):
+      frame = sys._current_frames().get(self.thread_id)
+      stack = []
+      while frame is not None:
+        code = frame.f_code
+        stack.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+        frame = frame.f_back
+      if stack:
+        self.stacks[';'.join(reversed(stack))] += 1
+
+
+'''
+RequestProfiler
+    profiles a sample of live requests and writes one file per request to
+    <directory>/<endpoint>/, either cProfile .pstats or .collapsed stacks.
+    A request is profiled when the sample rate picks it (enabled only), or
+    when it carries an X-Profile header signed with the profile secret.
+    Oldest files are removed beyond max_files or max_bytes.
+'''
+class RequestProfiler:
+
+  def __init__(self, directory, sample_rate=0.0, enabled=False, secret=None,
+               format='pstats', max_files=500, max_bytes=100 * 1024 * 1024):
+    self.directory = directory
+    self.sample_rate = sample_rate
+    self.enabled = enabled
+    self.signer = TimestampSigner(secret, salt='trivia-profile') if secret else None
+    self.format = format
+    self.max_files = max_files
+    self.max_bytes = max_bytes
+    self._sequence = itertools.count()
+    self._lock = threading.Lock()
+
+  def init_app(self, app):
+    app.before_request(self._start)
+    app.teardown_request(self._stop)
+
+  def sign(self):
+    '''value of the X-Profile header that asks for a profile'''
+    return self.signer.sign(b'profile').decode('ascii')
+
+  def _wanted(self):
+    header = request.headers.get(HEADER)
+    if header and self.signer is not None:
+      try:
+        self.signer.unsign(header, max_age=SIGNATURE_MAX_AGE)
+        return True
+      except BadSignature:
+        pass
+    return self.enabled and random.random() < self.sample_rate
+
+  def _start(self):
+    if not self._wanted():
+      return
+    if self.format == 'collapsed':
+      profiler = StackSampler(threading.get_ident())
+      profiler.start()
+    else:
+      profiler = cProfile.Profile()
+      try:
+        profiler.enable()
+      except ValueError:
+        # another profiler is already active in this thread
+        return
+    g.profiler = profiler
+
+  def _stop(self, error):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+      return
+    if isinstance(profiler, StackSampler):
+      profiler.stop()
+    else:
+      profiler.disable()
+
+    directory = os.path.join(self.directory, request.endpoint or 'unmatched')
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, '{}-{}-{}.{}'.format(
+        int(time.time() * 1000), os.getpid(), next(self._sequence), self.format))
+    if isinstance(profiler, StackSampler):
+      profiler.dump(path)
+    else:
+      profiler.dump_stats(path)
+    self._rotate()
+
+  def _rotate(self):
+    with self._lock:
+      files = sorted(profile_files(self.directory), key=lambda entry: entry[1].st_mtime)
+      total_bytes = sum(stat.st_size for _, stat in files)
+      while files and (len(files) > self.max_files or total_bytes > self.max_bytes):
+        path, stat = files.pop(0)
+        try:
+          os.remove(path)
+        except OSError:
+          pass
+        total_bytes -= stat.st_size
+
+
+'''
+Profile Files
+Parameters: profile directory
+Return: list of (path, os.stat_result) of every profile file below it
+'''
+def profile_files(directory):
+    files = []
+    for root, _, names in os.walk(directory):
+      for name in names:
+        if name.endswith(('.pstats', '.collapsed')):
+          path = os.path.join(root, name)
+          try:
+            files.append((path, os.stat(path)))
+          except OSError:
+            pass
+    return files
+#----------------------------------------------------------------------------#
+# Report
+#----------------------------------------------------------------------------#
+'''
+Report
+Parameters: profile directory, number of functions, pstats sort key,
+            endpoint to report on (all endpoints if None), output stream
+Return: None, prints the hottest functions of every endpoint
+'''
+def report(directory, top=20, sort='cumulative', endpoint=None, out=sys.stdout):
+    endpoints = [endpoint] if endpoint else sorted(os.listdir(directory))
+    for name in endpoints:
+      files = [path for path, _ in profile_files(os.path.join(directory, name))]
+      stats = [path for path in files if path.endswith('.pstats')]
+      stacks = [path for path in files if path.endswith('.collapsed')]
+      if stats:
+        out.write('\n== {} ({} profiled requests) ==\n'.format(name, len(stats)))
+        pstats.Stats(*stats, stream=out).strip_dirs().sort_stats(sort).print_stats(top)
+      if stacks:
+        self_samples, total_samples = Counter(), Counter()
+        for path in stacks:
+          with open(path) as f:
+            for line in f:
+              stack, count = line.rsplit(' ', 1)
+              frames = stack.split(';')
+              self_samples[frames[-1]] += int(count)
+              for frame in set(frames):
+                total_samples[frame] += int(count)
+        samples = sum(self_samples.values()) or 1
+        out.write('\n== {} ({} sampled requests, {} samples) ==\n'.format(name, len(stacks), samples))
+        out.write('{:>8} {:>8}  function\n'.format('self%', 'total%'))
+        for frame, count in self_samples.most_common(top):
+          out.write('{:>8.1f} {:>8.1f}  {}\n'.format(
+              count * 100.0 / samples, total_samples[frame] * 100.0 / samples, frame))
@@ -0,0 +1,130 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+import random
+from sqlalchemy import func
+from models import Question
+#----------------------------------------------------------------------------#
+# Constants
+#----------------------------------------------------------------------------#
+# difficulties a question can have, as offered by the frontend
+DIFFICULTIES = (1, 2, 3, 4, 5)
+#----------------------------------------------------------------------------#
+# Alias Table
+#----------------------------------------------------------------------------#
+'''
+AliasTable
+    Vose's alias method: after an O(n) build, draw() picks one of the keys
+    with probability proportional to its weight in O(1), one random index
+    and one coin flip, whatever the number of keys.
+'''
+class AliasTable:
+
+  def __init__(self, keys, weights):
+    total = float(sum(weights))
+    if not keys or total <= 0:
+      raise ValueError('An alias table needs a positive weight.')
+    self.keys = list(keys)
+    size = len(self.keys)
+    scaled = [weight * size / total for weight in weights]
+    self._probability = [1.0] * size
+    self._alias = list(range(size))
+    small = [index for index, value in enumerate(scaled) if value < 1.0]
+    large = [index for index, value in enumerate(scaled) if value >= 1.0]
+    while small and large:
+      less, more = small.pop(), large.pop()
+      self._probability[less] = scaled[less]
+      self._alias[less] = more
+      scaled[more] -= 1.0 - scaled[less]
+      (small if scaled[more] < 1.0 else large).append(more)
+    # what is left over is 1.0 up to rounding errors, keep it
+
+  def draw(self, rnd=random):
+    index = rnd.randrange(len(self.keys))
+    if rnd.random() >= self._probability[index]:
+      index = self._alias[index]
+    return self.keys[index]
+#----------------------------------------------------------------------------#
+# Difficulty Bands
+#----------------------------------------------------------------------------#
+'''
+DatabaseBands
+    questions of a category (all when None) grouped by difficulty, read
+    from the database: one GROUP BY for the counts, then one query per
+    question drawn. read_model.bands(category) serves the same calls from
+    memory, in constant time per draw.
+'''
+class DatabaseBands:
+
+  def __init__(self, category=None):
+    self.category = category
+
+  def counts(self, exclude):
+    '''{difficulty: number of questions not in exclude}'''
+    selection = self._selection(exclude)
+    return dict(selection.with_entities(Question.difficulty, func.count(Question.id))
+                         .group_by(Question.difficulty))
+
+  def draw(self, difficulty, exclude, total):
+    '''random question of the difficulty not in exclude, formated as
+    Question.format(), None if there is none; total is its count'''
+    question = (self._selection(exclude).filter(Question.difficulty == difficulty)
+                    .order_by(Question.id).offset(random.randrange(total)).limit(1).first())
+    return question.format() if question is not None else None
+
+  def _selection(self, exclude):
+    selection = Question.query
+    if self.category is not None:
+      selection = selection.filter(Question.category == self.category)
+    if exclude:
+      selection = selection.filter(Question.id.notin_(exclude))
+    return selection
+#----------------------------------------------------------------------------#
+# Deal
+#----------------------------------------------------------------------------#
+'''
+Deal
+Parameters: bands (DatabaseBands or read_model.bands()), number of questions,
+            ids already asked, and either
+            - curve: target difficulty per question of the round, by
+              position; the last one holds for longer rounds
+            - weights: {difficulty: weight}, drawn through an alias table
+            position of the first question in the round (previous questions)
+Return: up to count distinct questions formated as Question.format().
+        A target difficulty without questions left falls back to the
+        nearest one (the easier on a tie); weights only count difficulties
+        with questions left, and are ignored once all of those are zero
+'''
+def deal(bands, count, exclude=(), curve=None, weights=None, position=0):
+    exclude = set(exclude or ())
+    left = {difficulty: total for difficulty, total in bands.counts(exclude).items()
+            if difficulty is not None and total > 0}
+    table = None
+    questions = []
+    while left and len(questions) < count:
+      if curve:
+        target = curve[min(position + len(questions), len(curve) - 1)]
+        difficulty = min(left, key=lambda difficulty: (abs(difficulty - target), difficulty))
+      else:
+        if table is None:
+          table = band_table(left, weights)
+        difficulty = table.draw()
+      question = bands.draw(difficulty, exclude, left[difficulty])
+      if question is not None:
+        questions.append(question)
+        exclude.add(question['id'])
+      # a question deleted meanwhile also empties its band sooner
+      left[difficulty] -= 1
+      if question is None or not left[difficulty]:
+        del left[difficulty]
+        table = None
+    return questions
+
+def band_table(left, weights):
+    '''alias table over the difficulties with questions left'''
+    keys = sorted(left)
+    chances = [(weights or {}).get(difficulty, 0) for difficulty in keys]
+    if not weights or not any(chances):
+      # as likely as a uniform draw over the questions
+      chances = [left[difficulty] for difficulty in keys]
+    return AliasTable(keys, chances)
@@ -0,0 +1,134 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+import random
+import secrets
+import threading
+import time
+from collections import deque
+#----------------------------------------------------------------------------#
+# Quiz Session Stores
+#----------------------------------------------------------------------------#
+'''
+Quiz session stores keep a pre-shuffled deck of question ids per quiz
+session, so each round only pops the next id instead of sending and
+filtering the full previous_questions list.
+
+Every store implements:
+    start(question_ids) -> token
+    pop(token)          -> next question id, None when the deck is empty,
+                           raises KeyError for an unknown or expired token
+    end(token)
+'''
+
+'''
+MemoryDeckStore
+    decks kept in a dict of this process, expired after ttl seconds.
+    Only suitable for a single worker process.
+'''
+class MemoryDeckStore:
+
+  def __init__(self, ttl):
+    self.ttl = ttl
+    self._decks = {}
+    self._lock = threading.Lock()
+
+  def start(self, question_ids):
+    deck = list(question_ids)
+    random.shuffle(deck)
+    token = secrets.token_urlsafe(16)
+    with self._lock:
+      self._expire()
+      self._decks[token] = (deque(deck), time.monotonic() + self.ttl)
+    return token
+
+  def pop(self, token):
+    with self._lock:
+      deck, expires_at = self._decks[token]
+      if expires_at < time.monotonic():
+        del self._decks[token]
+        raise KeyError(token)
+      self._decks[token] = (deck, time.monotonic() + self.ttl)
+      return deck.popleft() if deck else None
+
+  def end(self, token):
+    with self._lock:
+      self._decks.pop(token, None)
+
+  def _expire(self):
+    now = time.monotonic()
+    for token in [token for token, (_, expires_at) in self._decks.items() if expires_at < now]:
+      del self._decks[token]
+
+
+'''
+RedisDeckStore
+    decks kept in a Redis list per session, shared by all worker processes.
+    client is any object with the redis-py list API (redis.Redis, or a
+    local Redis-compatible stand-in such as fakeredis.FakeRedis).
+'''
+class RedisDeckStore:
+
+  def __init__(self, client, ttl, prefix='trivia:quiz:'):
+    self.client = client
+    self.ttl = ttl
+    self.prefix = prefix
+
+  def start(self, question_ids):
+    deck = list(question_ids)
+    random.shuffle(deck)
+    token = secrets.token_urlsafe(16)
+    # the marker key tells an exhausted deck apart from an unknown token,
+    # since Redis drops empty lists
+    pipe = self.client.pipeline()
+    pipe.set(self._marker(token), len(deck), ex=self.ttl)
+    if deck:
+      pipe.rpush(self._deck(token), *deck)
+      pipe.expire(self._deck(token), self.ttl)
+    pipe.execute()
+    return token
+
+  def pop(self, token):
+    pipe = self.client.pipeline()
+    pipe.expire(self._marker(token), self.ttl)
+    pipe.lpop(self._deck(token))
+    pipe.expire(self._deck(token), self.ttl)
+    found, question_id, _ = pipe.execute()
+    if not found:
+      raise KeyError(token)
+    return int(question_id) if question_id is not None else None
+
+  def end(self, token):
+    self.client.delete(self._marker(token), self._deck(token))
+
+  def _marker(self, token):
+    return self.prefix + token
+
+  def _deck(self, token):
+    return self.prefix + token + ':deck'
+
+
+'''
+Create Deck Store
+Parameters: store url, 'memory' or a redis:// url; session ttl in seconds;
+            worker processes serving the app
+Return: quiz session store, None for 'memory' with more than one worker,
+        where the next round of a session may reach a worker without it
+'''
+def create_deck_store(url, ttl, workers=1):
+    if url == 'memory':
+      return MemoryDeckStore(ttl) if workers <= 1 else None
+    return RedisDeckStore(redis_client(url), ttl)
+
+
+'''
+Redis Client
+Parameters: redis:// url, or fakeredis:// for a local Redis-compatible stand-in
+Return: redis-py compatible client
+'''
+def redis_client(url):
+    if url.startswith('fakeredis://'):
+      import fakeredis
+      return fakeredis.FakeRedis()
+    import redis
+    return redis.Redis.from_url(url)
@@ -0,0 +1,391 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+import logging
+import random
+import select
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session, object_session
+from models import db, Question, data_version
+from flaskr.pagination import QUESTIONS_PER_PAGE, QUESTION_FIELDS, QuestionPage, parse_fields, decode_cursor
+#----------------------------------------------------------------------------#
+# Constants
+#----------------------------------------------------------------------------#
+# Postgres channel of the question change notifications
+CHANNEL = 'trivia_questions'
+logger = logging.getLogger(__name__)
+#----------------------------------------------------------------------------#
+# Read Model
+#----------------------------------------------------------------------------#
+'''
+QuestionRow
+    columns of a question besides its id, kept as compact as a tuple
+'''
+class QuestionRow:
+  __slots__ = ('question', 'answer', 'category', 'difficulty')
+
+  def __init__(self, question, answer, category, difficulty):
+    self.question = question
+    self.answer = answer
+    self.category = category
+    self.difficulty = difficulty
+
+  def format(self, question_id):
+    return {
+      'id': question_id,
+      'question': self.question,
+      'answer': self.answer,
+      'category': str(self.category) if self.category is not None else None,
+      'difficulty': self.difficulty
+    }
+
+
+'''
+SnapshotBands
+    questions of a category (all when None) by difficulty, served from
+    the read model for quiz_sampling.deal(): a draw picks random ids of
+    the difficulty's array until one is not excluded, constant time as
+    long as most of them are not; otherwise it picks among the others.
+'''
+class SnapshotBands:
+
+  def __init__(self, model, category):
+    self.model = model
+    self.category = category
+
+  def counts(self, exclude):
+    with self.model._lock:
+      counts = {difficulty: len(ids) for difficulty, ids in self._bands().items()}
+      for question_id in exclude:
+        row = self.model._rows.get(question_id)
+        if row is not None and row.difficulty in counts and self.category in (None, row.category):
+          counts[row.difficulty] -= 1
+      return counts
+
+  def draw(self, difficulty, exclude, total):
+    with self.model._lock:
+      ids = self._bands().get(difficulty, ())
+      if not ids:
+        return None
+      if len(ids) <= 2 * total:
+        for _ in range(8):
+          question_id = ids[random.randrange(len(ids))]
+          if question_id not in exclude:
+            return self.model._rows[question_id].format(question_id)
+      # most ids are excluded, pick among the others
+      candidates = [question_id for question_id in ids if question_id not in exclude]
+      if not candidates:
+        return None
+      question_id = random.choice(candidates)
+      return self.model._rows[question_id].format(question_id)
+
+  def _bands(self):
+    if self.category is None:
+      return self.model._by_difficulty
+    return self.model._by_band.get(self.category, {})
+
+
+'''
+ReadModel
+    in-process snapshot of the questions table: the rows by id, a sorted
+    array of all ids, and sorted arrays of ids per category, per difficulty
+    and per category and difficulty, so pages, totals and quiz draws
+    are served from memory.
+    Loaded on first use, then refreshed incrementally:
+    - writes committed by this process are applied from the mapper events
+    - with refresh='notify' (Postgres), every question write also sends a
+      NOTIFY on CHANNEL in its transaction; a listener thread per process
+      queues them and the next read applies them
+    - with refresh='version', a data version moved by another process or
+      a bulk insert makes the next read reload the snapshot. It needs a
+      data version shared by the processes (shared_version), otherwise
+      the read model stays off and reads go to the database
+    The snapshot is dropped, and reads go to the database, when it grows
+    beyond max_bytes. One read model per process, shared by every app:
+    read_model.
+'''
+class ReadModel:
+
+  def __init__(self):
+    self.enabled = False
+    self.refresh = 'version'
+    self.max_bytes = 0
+    self.loads = 0
+    self.overflow = False
+    self._rows = None
+    self._ids = array('q')
+    self._by_category = {}
+    self._by_difficulty = {}
+    self._by_band = {}
+    self._bytes = 0
+    self._version = None
+    self._pending = deque()
+    self._listener = None
+    self._lock = threading.RLock()
+    for _event in ('after_insert', 'after_update'):
+      event.listen(Question, _event, self._on_write)
+    event.listen(Question, 'after_delete', self._on_delete)
+    event.listen(Session, 'before_commit', self._before_commit)
+    event.listen(Session, 'after_commit', self._after_commit)
+    event.listen(Session, 'after_soft_rollback', self._discard_changes)
+
+  def configure(self, enabled, refresh='version', max_bytes=64 * 1024 * 1024, shared_version=True):
+    if enabled and refresh == 'version' and not shared_version:
+      logger.warning('The read model would not see the writes of other workers with '
+                     "refresh='version' and their own data version, reads go to the database")
+      enabled = False
+    self.enabled = enabled
+    self.refresh = refresh
+    self.max_bytes = max_bytes
+
+  def active(self):
+    '''True when reads are served from the snapshot. Loads it, or applies
+    the pending changes, first; needs an app context'''
+    if not self.enabled or self.overflow:
+      return False
+    with self._lock:
+      if self._rows is None:
+        self._load()
+      elif self._pending:
+        self._apply_notifications()
+      elif self.refresh == 'version' and data_version.current()[0] != self._version:
+        self._load()
+      return self._rows is not None
+
+  def count(self, category=None):
+    with self._lock:
+      return len(self._ids if category is None else self._by_category.get(category, ()))
+
+  def paginate(self, request, category=None):
+    '''page of questions formated as pagination.paginate_questions, with
+    the same ?page=, ?cursor= and ?fields= handling'''
+    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor', None)
+    fields = parse_fields(request.args.get('fields'))
+
+    with self._lock:
+      ids = self._ids if category is None else self._by_category.get(category, array('q'))
+      if cursor:
+        start = bisect_right(ids, decode_cursor(cursor))
+      elif page < 1:
+        return []
+      else:
+        start = (page - 1) * QUESTIONS_PER_PAGE
+      questions = [self._rows[question_id].format(question_id)
+                   for question_id in ids[start:start + QUESTIONS_PER_PAGE]]
+      more = start + QUESTIONS_PER_PAGE < len(ids)
+    if fields != QUESTION_FIELDS:
+      questions = [{field: question[field] for field in fields} for question in questions]
+    return QuestionPage(questions, more)
+
+  def sample(self, category=None, exclude=None, count=1):
+    '''up to count distinct random questions of the category (all when
+    None) whose ids are not in exclude, formated as Question.format()'''
+    exclude = set(exclude or ())
+    with self._lock:
+      ids = self._ids if category is None else self._by_category.get(category, array('q'))
+      if len(ids) <= 4 * (len(exclude) + count):
+        candidates = [question_id for question_id in ids if question_id not in exclude]
+        picked = random.sample(candidates, min(count, len(candidates)))
+      else:
+        # most ids are eligible, draw until enough of them are
+        picked = set()
+        while len(picked) < count:
+          question_id = ids[random.randrange(len(ids))]
+          if question_id not in exclude:
+            picked.add(question_id)
+      return [self._rows[question_id].format(question_id) for question_id in picked]
+
+  def bands(self, category=None):
+    '''difficulty bands of the category for quiz_sampling.deal()'''
+    return SnapshotBands(self, category)
+
+  def stats(self):
+    with self._lock:
+      return {
+        'ready': int(self._rows is not None),
+        'overflow': int(self.overflow),
+        'rows': len(self._ids),
+        'categories': len(self._by_category),
+        'bytes': self._memory(),
+        'max_bytes': self.max_bytes,
+        'loads': self.loads
+      }
+
+  def _load(self):
+    if self.refresh == 'notify' and self._listener is None:
+      # listen before reading, changes committed meanwhile are applied
+      # again on the next read
+      self._listener = threading.Thread(target=self._listen, daemon=True)
+      self._listener.start()
+    version = data_version.current()[0]
+    self._rows = {}
+    self._ids = array('q')
+    self._by_category = {}
+    self._by_difficulty = {}
+    self._by_band = {}
+    self._bytes = 0
+    rows = db.session.query(Question.id, Question.question, Question.answer,
+                            Question.category, Question.difficulty).order_by(Question.id)
+    for question_id, question, answer, category, difficulty in rows:
+      row = QuestionRow(question, answer, category, difficulty)
+      self._rows[question_id] = row
+      self._ids.append(question_id)
+      self._by_category.setdefault(category, array('q')).append(question_id)
+      self._by_difficulty.setdefault(difficulty, array('q')).append(question_id)
+      self._by_band.setdefault(category, {}).setdefault(difficulty, array('q')).append(question_id)
+      self._bytes += self._row_bytes(row)
+      if self._memory() > self.max_bytes:
+        self._drop()
+        return
+    self._version = version
+    self.loads += 1
+
+  def _drop(self):
+    logger.warning('Question read model exceeds %d bytes, reads go to the database', self.max_bytes)
+    self.overflow = True
+    self._rows = None
+    self._ids = array('q')
+    self._by_category = {}
+    self._by_difficulty = {}
+    self._by_band = {}
+    self._bytes = 0
+
+  def _memory(self):
+    # rows and their texts, plus the containers holding them
+    return (self._bytes + sys.getsizeof(self._rows or {}) + sys.getsizeof(self._ids) +
+            sum(sys.getsizeof(ids) for ids in self._by_category.values()) +
+            sum(sys.getsizeof(ids) for ids in self._by_difficulty.values()) +
+            sum(sys.getsizeof(ids) for bands in self._by_band.values() for ids in bands.values()))
+
+  def _row_bytes(self, row):
+    return sys.getsizeof(row) + sys.getsizeof(row.question or '') + sys.getsizeof(row.answer or '')
+
+  def _put(self, question_id, row):
+    self._remove(question_id)
+    self._rows[question_id] = row
+    insort(self._ids, question_id)
+    insort(self._by_category.setdefault(row.category, array('q')), question_id)
+    insort(self._by_difficulty.setdefault(row.difficulty, array('q')), question_id)
+    insort(self._by_band.setdefault(row.category, {}).setdefault(row.difficulty, array('q')), question_id)
+    self._bytes += self._row_bytes(row)
+
+  def _remove(self, question_id):
+    row = self._rows.pop(question_id, None)
+    if row is None:
+      return
+    bands = self._by_band[row.category]
+    for ids in (self._ids, self._by_category[row.category], self._by_difficulty[row.difficulty],
+                bands[row.difficulty]):
+      del ids[bisect_left(ids, question_id)]
+    if not self._by_category[row.category]:
+      del self._by_category[row.category]
+    if not self._by_difficulty[row.difficulty]:
+      del self._by_difficulty[row.difficulty]
+    if not bands[row.difficulty]:
+      del bands[row.difficulty]
+      if not bands:
+        del self._by_band[row.category]
+    self._bytes -= self._row_bytes(row)
+
+  def _apply(self, changes):
+    for question_id, row in changes:
+      if row is None:
+        self._remove(question_id)
+      else:
+        self._put(question_id, row)
+    if self._memory() > self.max_bytes:
+      self._drop()
+
+  def _apply_notifications(self):
+    changed = set()
+    while self._pending:
+      payload = self._pending.popleft()
+      if payload == 'reload':
+        self._load()
+        return
+      changed.add(int(payload.split(' ', 1)[1]))
+    rows = {question_id: QuestionRow(question, answer, category, difficulty)
+            for question_id, question, answer, category, difficulty in
+            db.session.query(Question.id, Question.question, Question.answer,
+                             Question.category, Question.difficulty)
+                      .filter(Question.id.in_(changed))}
+    # ids that are gone were deleted
+    self._apply([(question_id, rows.get(question_id)) for question_id in sorted(changed)])
+
+  def _listen(self):
+    '''LISTEN on CHANNEL from a dedicated connection, queueing payloads'''
+    reconnect = False
+    while True:
+      try:
+        connection = db.engine.connect().detach().connection.connection
+        connection.autocommit = True
+        connection.cursor().execute('LISTEN ' + CHANNEL)
+        if reconnect:
+          # notifications may have been missed while disconnected
+          self._pending.append('reload')
+        reconnect = True
+        while True:
+          if select.select([connection], [], [], 60) != ([], [], []):
+            connection.poll()
+            while connection.notifies:
+              self._pending.append(connection.notifies.pop(0).payload)
+      except Exception:
+        logger.exception('Question read model listener failed, reconnecting')
+        time.sleep(1)
+
+  def _on_write(self, mapper, connection, target):
+    self._record(connection, target, QuestionRow(target.question, target.answer,
+                                                 target.category, target.difficulty))
+
+  def _on_delete(self, mapper, connection, target):
+    self._record(connection, target, None)
+
+  def _record(self, connection, target, row):
+    '''keep the change for after the commit, and tell the other
+    processes through a NOTIFY sent with the same transaction'''
+    session = object_session(target)
+    if not self.enabled or session is None:
+      return
+    session.info.setdefault('read_model_changes', []).append((target.id, row))
+    if self.refresh == 'notify' and connection.dialect.name == 'postgresql':
+      connection.execute(text('SELECT pg_notify(:channel, :payload)'), channel=CHANNEL,
+                         payload='{} {}'.format('delete' if row is None else 'write', target.id))
+
+  def _before_commit(self, session):
+    # bulk inserts skip the mapper events, ask every process to reload
+    if (self.enabled and self.refresh == 'notify' and session.info.get('bulk_inserted') and
+        session.get_bind().dialect.name == 'postgresql'):
+      session.execute(text('SELECT pg_notify(:channel, :payload)'),
+                      {'channel': CHANNEL, 'payload': 'reload'})
+
+  def _after_commit(self, session):
+    changes = session.info.pop('read_model_changes', None)
+    bulk_inserted = session.info.pop('bulk_inserted', False)
+    if self._rows is None or not (changes or bulk_inserted):
+      return
+    with self._lock:
+      if self._rows is None:
+        return
+      if bulk_inserted:
+        self._rows = None
+        return
+      expected = self._version + 1
+      self._apply(changes)
+      # the data version listener of models ran first; when only this
+      # commit moved it, the snapshot is current
+      if self._rows is not None and data_version.current()[0] == expected:
+        self._version = expected
+
+  def _discard_changes(self, session, previous_transaction):
+    session.info.pop('read_model_changes', None)
+    session.info.pop('bulk_inserted', None)
+
+
+read_model = ReadModel()
@@ -0,0 +1,159 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+import itertools
+import logging
+import threading
+import time
+from functools import wraps
+from flask import g, session, has_request_context
+from sqlalchemy import event, exc, text
+from sqlalchemy.orm import Session
+from models import db, data_version
+#----------------------------------------------------------------------------#
+# Constants
+#----------------------------------------------------------------------------#
+# key of the read-your-writes deadline in the flask session cookie
+STICKY_KEY = 'primary_until'
+logger = logging.getLogger(__name__)
+#----------------------------------------------------------------------------#
+# Read Replicas
+#----------------------------------------------------------------------------#
+'''
+Replica
+    one read replica: its bind name and health
+'''
+class Replica:
+
+  def __init__(self, name, url):
+    self.name = name
+    self.url = url
+    self.healthy = True
+    self.checked_at = 0.0
+    self.failures = 0
+
+
+'''
+ReplicaRouter
+    sends the queries of views decorated with reads() to the read replicas,
+    round-robin, while writes stay on the primary database.
+    - replicas are SQLALCHEMY_BINDS of the app ('replica_0', ...), sharing
+      the engine and pool options of the primary
+    - a replica that fails a query or a health check is skipped, and
+      checked again with SELECT 1 every health_interval seconds; the view
+      is retried once on the primary
+    - a streamed response keeps reading from the replica while its body
+      is sent, until the body is closed
+    - read-your-writes: after a request commits a write, the client reads
+      from the primary for sticky_seconds, tracked in the session cookie.
+      Every client reads from the primary for sticky_seconds after the
+      data version moved, so no lagging page is cached by the response
+      cache or the in-process caches under the new version
+'''
+class ReplicaRouter:
+
+  def __init__(self, urls, health_interval=10, sticky_seconds=5):
+    self.replicas = [Replica('replica_{}'.format(i), url) for i, url in enumerate(urls)]
+    self.health_interval = health_interval
+    self.sticky_seconds = sticky_seconds
+    self._turn = itertools.count()
+    self._lock = threading.Lock()
+
+  def init_app(self, app):
+    if not self.replicas:
+      return
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    binds.update({replica.name: replica.url for replica in self.replicas})
+    app.config['SQLALCHEMY_BINDS'] = binds
+    app.after_request(self._stick)
+
+  def reads(self, view):
+    '''decorator for read-only views, run on a replica when one is healthy'''
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+      replica = self._choose()
+      if replica is None:
+        return view(*args, **kwargs)
+      engine = db.session.info['replica'] = db.get_engine(bind=replica.name)
+      try:
+        response = view(*args, **kwargs)
+        if getattr(response, 'is_streamed', False):
+          # the body queries run once the view returned, as it is sent
+          response.response = self._streamed(response.response, engine)
+        return response
+      except exc.DBAPIError as error:
+        if not error.connection_invalidated and not isinstance(error, exc.OperationalError):
+          raise
+        logger.warning('Read replica %s failed, retrying on the primary', replica.name)
+        self._mark(replica, False)
+        db.session.info.pop('replica', None)
+        db.session.rollback()
+        return view(*args, **kwargs)
+      finally:
+        db.session.info.pop('replica', None)
+    return wrapper
+
+  def _streamed(self, chunks, engine):
+    '''chunks of a streamed body, read from the replica until it is closed'''
+    db.session.info['replica'] = engine
+    try:
+      yield from chunks
+    finally:
+      db.session.info.pop('replica', None)
+
+  def status(self):
+    return [{
+      'name': replica.name,
+      'healthy': replica.healthy,
+      'failures': replica.failures
+    } for replica in self.replicas]
+
+  def _choose(self):
+    if not self.replicas or session.get(STICKY_KEY, 0) > time.time():
+      return None
+    if time.time() - data_version.current()[1] < self.sticky_seconds:
+      return None
+    for _ in range(len(self.replicas)):
+      replica = self.replicas[next(self._turn) % len(self.replicas)]
+      if replica.healthy or self._check(replica):
+        return replica
+    return None
+
+  def _check(self, replica):
+    '''health check of a replica marked unhealthy, once per health_interval'''
+    with self._lock:
+      if time.monotonic() - replica.checked_at < self.health_interval:
+        return False
+      replica.checked_at = time.monotonic()
+    try:
+      with db.get_engine(bind=replica.name).connect() as connection:
+        connection.execute(text('SELECT 1'))
+    except exc.DBAPIError:
+      self._mark(replica, False)
+      return False
+    self._mark(replica, True)
+    return True
+
+  def _mark(self, replica, healthy):
+    with self._lock:
+      if not healthy:
+        replica.failures += 1
+        replica.checked_at = time.monotonic()
+      replica.healthy = healthy
+
+  def _stick(self, response):
+    if g.pop('replica_wrote', False):
+      session[STICKY_KEY] = time.time() + self.sticky_seconds
+    return response
+
+
+'''
+Flag the request when its session commits a write to questions or
+categories. Inserted before the data version listener, which pops the
+data_changed flag.
+'''
+def _flag_write(db_session):
+    if has_request_context() and db_session.info.get('data_changed'):
+      g.replica_wrote = True
+
+event.listen(Session, 'after_commit', _flag_write, insert=True)
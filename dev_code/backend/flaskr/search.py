@@ -0,0 +1,184 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+import threading
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session, object_session
+from models import db, Question, data_version
+from flaskr.pagination import count_questions, paginate_questions, paginate_question_ids
+#----------------------------------------------------------------------------#
+# Question Search
+#----------------------------------------------------------------------------#
+'''
+Question search backends. Both match questions containing the search term
+(case-insensitive substring, same as ILIKE '%term%') and implement:
+    search(request, term, rank) -> (total_questions, questions of the page)
+With rank, the best matching questions come first; otherwise by id.
+'''
+
+'''
+Contains Pattern
+Parameters: search term
+Return: LIKE pattern matching texts containing term, its %, _ and
+        backslashes escaped with a backslash (escape='\\')
+'''
+def contains_pattern(term):
+    return '%{}%'.format(term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_'))
+
+
+'''
+SqlQuestionSearch
+    ILIKE query paginated in SQL. On Postgres the pg_trgm GIN index added
+    by the migrations serves the leading-wildcard ILIKE, and rank orders by
+    trigram similarity.
+'''
+class SqlQuestionSearch:
+
+  def search(self, request, term, rank=False):
+    selection = Question.query.filter(Question.question.ilike(contains_pattern(term), escape='\\'))
+    total_questions = count_questions(selection)
+    if total_questions == 0:
+      return 0, []
+
+    if rank:
+      selection = selection.order_by(func.similarity(Question.question, term).desc())
+    return total_questions, paginate_questions(request, selection)
+
+
+'''
+IndexedQuestionSearch
+    in-process trigram inverted index of Question.question, for SQLite and
+    tests. Built from the questions table on first use. Question writes
+    are applied once committed; when the data version moves otherwise
+    (bulk inserts, other processes), the index is built again on next use.
+    One index per process, shared by every app: question_index.
+'''
+class IndexedQuestionSearch:
+
+  def __init__(self):
+    self._texts = None
+    self._grams = {}
+    self._version = None
+    self._lock = threading.Lock()
+    for _event in ('after_insert', 'after_update'):
+      event.listen(Question, _event, self._on_write)
+    event.listen(Question, 'after_delete', self._on_delete)
+    event.listen(Session, 'after_commit', self._after_commit)
+    event.listen(Session, 'after_soft_rollback', self._discard_changes)
+
+  def search(self, request, term, rank=False):
+    question_ids = self.match(term, rank)
+    return len(question_ids), paginate_question_ids(request, question_ids)
+
+  def match(self, term, rank=False):
+    '''ids of the questions containing term, ascending or best match first'''
+    term = term.lower()
+    with self._lock:
+      if self._texts is None or data_version.current()[0] != self._version:
+        self._build()
+      grams = sorted((self._grams.get(gram, ()) for gram in trigrams(term)), key=len)
+      if grams:
+        candidates = set(grams[0]).intersection(*grams[1:])
+      else:
+        # terms shorter than a trigram are checked against every question
+        candidates = self._texts.keys()
+      question_ids = sorted(question_id for question_id in candidates
+                            if term in self._texts[question_id])
+      if rank:
+        # shorter questions share a larger part of their text with the term
+        question_ids.sort(key=lambda question_id: len(self._texts[question_id]))
+    return question_ids
+
+  def invalidate(self):
+    with self._lock:
+      self._texts = None
+      self._grams = {}
+
+  def _build(self):
+    version = data_version.current()[0]
+    self._texts = {}
+    self._grams = {}
+    for question_id, text in db.session.query(Question.id, Question.question):
+      self._add(question_id, text)
+    self._version = version
+
+  def _add(self, question_id, text):
+    text = (text or '').lower()
+    self._texts[question_id] = text
+    for gram in trigrams(text):
+      self._grams.setdefault(gram, set()).add(question_id)
+
+  def _remove(self, question_id):
+    text = self._texts.pop(question_id, None)
+    for gram in trigrams(text or ''):
+      self._grams.get(gram, set()).discard(question_id)
+
+  def _on_write(self, mapper, connection, target):
+    self._record(target, target.question)
+
+  def _on_delete(self, mapper, connection, target):
+    self._record(target, None)
+
+  def _record(self, target, text):
+    '''keep the change for after the commit'''
+    session = object_session(target)
+    if session is None or self._texts is None:
+      return
+    session.info.setdefault('search_changes', []).append((target.id, text))
+
+  def _after_commit(self, session):
+    changes = session.info.pop('search_changes', None)
+    if not changes or self._texts is None:
+      return
+    with self._lock:
+      if self._texts is None:
+        return
+      expected = self._version + 1
+      for question_id, text in changes:
+        self._remove(question_id)
+        if text is not None:
+          self._add(question_id, text)
+      # the data version listener of models ran first; when only this
+      # commit moved it, the index is current
+      if data_version.current()[0] == expected:
+        self._version = expected
+
+  def _discard_changes(self, session, previous_transaction):
+    session.info.pop('search_changes', None)
+
+
+question_index = IndexedQuestionSearch()
+
+
+'''
+Trigrams
+Parameters: lowercased text
+Return: set of the 3 character substrings of text
+'''
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+'''
+QuestionSearch
+    picks the backend on first use: 'sql' on Postgres, 'index' otherwise,
+    unless a backend is configured explicitly.
+'''
+class QuestionSearch:
+
+  def __init__(self, backend='auto'):
+    self.backend = backend
+    self._search = None
+
+  def search(self, request, term, rank=False):
+    if self._search is None:
+      backend = self.backend
+      if backend == 'auto':
+        backend = 'sql' if db.engine.dialect.name == 'postgresql' else 'index'
+      self._search = SqlQuestionSearch() if backend == 'sql' else question_index
+    return self._search.search(request, term, rank)
+
+  def invalidate(self):
+    '''rebuild the in-process index on next use, after writes that skip
+    the mapper events (bulk inserts)'''
+    question_index.invalidate()
@@ -0,0 +1,241 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+import re
+import threading
+import time
+from array import array
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from models import db, Question, data_version
+#----------------------------------------------------------------------------#
+# Constants
+#----------------------------------------------------------------------------#
+WORD = re.compile(r'\w+')
+# the suggestions can complete a question or an answer
+FIELDS = ('question', 'answer')
+# an entry packs a suggestion id and the offset of a word in its text
+OFFSET_BITS = 16
+OFFSET_MASK = (1 << OFFSET_BITS) - 1
+#----------------------------------------------------------------------------#
+# Question Suggestions
+#----------------------------------------------------------------------------#
+'''
+Words
+Parameters: text
+Return: list of the lowercased words of text
+'''
+def words(text):
+    return WORD.findall((text or '').lower())
+
+
+'''
+Word Starts
+Parameters: words joined by single spaces
+Return: offsets where the words start
+'''
+def word_starts(normalized):
+    return [match.start() for match in WORD.finditer(normalized) if match.start() <= OFFSET_MASK]
+
+
+'''
+QuestionSuggestions
+    in-process prefix index of Question.question and Question.answer, for
+    search-as-you-type. A suggestion is a distinct question or answer
+    text; it is matched on its words, lowercased and joined by spaces.
+    The index is a flattened trie: every word start of every suggestion
+    is an int in an array sorted by the text from there on, so the
+    suggestions completing a prefix are a contiguous range found by
+    bisection, in O(log n) plus the number of suggestions returned.
+    Built from the questions table on first use. Question writes are
+    applied once committed; when the data version moves otherwise (bulk
+    inserts, other processes), the index is built again on next use. When
+    the data version does not see the writes of other processes, max_age
+    bounds how long the index is used before it is built again.
+    One index per process, shared by every app: question_suggestions.
+'''
+class QuestionSuggestions:
+
+  def __init__(self, size=10):
+    self.size = size
+    self.max_age = None
+    self.builds = 0
+    self._built_at = 0
+    self._ids = None
+    self._keys = []
+    self._texts = []
+    self._refs = []
+    self._questions = {}
+    # entries at the start of their text, then at a later word
+    self._heads = array('q')
+    self._tails = array('q')
+    self._version = None
+    self._lock = threading.Lock()
+    for _event in ('after_insert', 'after_update'):
+      event.listen(Question, _event, self._on_write)
+    event.listen(Question, 'after_delete', self._on_delete)
+    event.listen(Session, 'after_commit', self._after_commit)
+    event.listen(Session, 'after_soft_rollback', self._discard_changes)
+
+  def configure(self, size, max_age=None):
+    '''size: most suggestions returned, max_age: seconds before the index
+    is built again, None to only build it again when the data version moved'''
+    self.size = size
+    self.max_age = max_age
+
+  def suggest(self, prefix, limit=None):
+    '''up to limit {'text', 'field'} completing prefix: the texts starting
+    with it, then the texts with a later word starting with it, each in
+    alphabetical order. Needs an app context on first use'''
+    phrase = ' '.join(words(prefix))
+    if not phrase:
+      return []
+    if prefix[-1:].isspace():
+      # the last word is complete
+      phrase += ' '
+    limit = min(limit or self.size, self.size)
+    with self._lock:
+      if (self._ids is None or data_version.current()[0] != self._version or
+          self.max_age is not None and time.monotonic() - self._built_at >= self.max_age):
+        self._build()
+      found = []
+      for entries in (self._heads, self._tails):
+        index = self._bisect(entries, phrase)
+        while len(found) < limit and index < len(entries):
+          entry = entries[index]
+          if not self._suffix(entry).startswith(phrase):
+            break
+          if entry >> OFFSET_BITS not in found:
+            found.append(entry >> OFFSET_BITS)
+          index += 1
+      return [{'text': self._texts[suggestion_id], 'field': self._keys[suggestion_id][0]}
+              for suggestion_id in found]
+
+  def invalidate(self):
+    with self._lock:
+      self._ids = None
+
+  def stats(self):
+    with self._lock:
+      return {
+        'built': self._ids is not None,
+        'builds': self.builds,
+        'suggestions': len(self._ids or ()),
+        'entries': len(self._heads) + len(self._tails)
+      }
+
+  def _build(self):
+    version = data_version.current()[0]
+    self._ids = {}
+    self._keys = []
+    self._texts = []
+    self._refs = []
+    self._questions = {}
+    for question_id, question, answer in db.session.query(Question.id, Question.question,
+                                                          Question.answer):
+      self._questions[question_id] = self._count(question, answer)[0]
+    heads, tails = [], []
+    for suggestion_id, key in enumerate(self._keys):
+      for offset in word_starts(key[1]):
+        (tails if offset else heads).append(suggestion_id << OFFSET_BITS | offset)
+    self._heads = array('q', sorted(heads, key=self._suffix))
+    self._tails = array('q', sorted(tails, key=self._suffix))
+    self._version = version
+    self._built_at = time.monotonic()
+    self.builds += 1
+
+  def _suffix(self, entry):
+    return self._keys[entry >> OFFSET_BITS][1][entry & OFFSET_MASK:]
+
+  def _bisect(self, entries, phrase):
+    '''index of the first entry not before phrase'''
+    low, high = 0, len(entries)
+    while low < high:
+      middle = (low + high) // 2
+      if self._suffix(entries[middle]) < phrase:
+        low = middle + 1
+      else:
+        high = middle
+    return low
+
+  def _count(self, question, answer):
+    '''adds a use of the texts of a question, returns the ids of its
+    suggestions and the ids new to the index'''
+    suggestion_ids, added = [], []
+    for field, text in zip(FIELDS, (question, answer)):
+      key = (field, ' '.join(words(text)))
+      if not key[1]:
+        continue
+      suggestion_id = self._ids.get(key)
+      if suggestion_id is None:
+        suggestion_id = self._ids[key] = len(self._keys)
+        self._keys.append(key)
+        self._texts.append(text.strip())
+        self._refs.append(0)
+        added.append(suggestion_id)
+      self._refs[suggestion_id] += 1
+      suggestion_ids.append(suggestion_id)
+    return tuple(suggestion_ids), added
+
+  def _index(self, suggestion_id):
+    for offset in word_starts(self._keys[suggestion_id][1]):
+      entries = self._tails if offset else self._heads
+      entry = suggestion_id << OFFSET_BITS | offset
+      entries.insert(self._bisect(entries, self._suffix(entry)), entry)
+
+  def _unindex(self, suggestion_id):
+    for offset in word_starts(self._keys[suggestion_id][1]):
+      entries = self._tails if offset else self._heads
+      entry = suggestion_id << OFFSET_BITS | offset
+      index = self._bisect(entries, self._suffix(entry))
+      while entries[index] != entry:
+        index += 1
+      del entries[index]
+    del self._ids[self._keys[suggestion_id]]
+    # the id is not reused until the next build
+    self._keys[suggestion_id] = self._texts[suggestion_id] = None
+
+  def _apply(self, changes):
+    for question_id, texts in changes:
+      for suggestion_id in self._questions.pop(question_id, ()):
+        self._refs[suggestion_id] -= 1
+        if not self._refs[suggestion_id]:
+          self._unindex(suggestion_id)
+      if texts is not None:
+        suggestion_ids, added = self._count(*texts)
+        self._questions[question_id] = suggestion_ids
+        for suggestion_id in added:
+          self._index(suggestion_id)
+
+  def _on_write(self, mapper, connection, target):
+    self._record(target, (target.question, target.answer))
+
+  def _on_delete(self, mapper, connection, target):
+    self._record(target, None)
+
+  def _record(self, target, texts):
+    '''keep the change for after the commit'''
+    session = object_session(target)
+    if session is None or self._ids is None:
+      return
+    session.info.setdefault('suggestion_changes', []).append((target.id, texts))
+
+  def _after_commit(self, session):
+    changes = session.info.pop('suggestion_changes', None)
+    if not changes or self._ids is None:
+      return
+    with self._lock:
+      if self._ids is None:
+        return
+      expected = self._version + 1
+      self._apply(changes)
+      # the data version listener of models ran first; when only this
+      # commit moved it, the index is current
+      if data_version.current()[0] == expected:
+        self._version = expected
+
+  def _discard_changes(self, session, previous_transaction):
+    session.info.pop('suggestion_changes', None)
+
+
+question_suggestions = QuestionSuggestions()
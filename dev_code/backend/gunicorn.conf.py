@@ -0,0 +1,24 @@
+# gunicorn settings for the trivia API:  gunicorn "flaskr:create_app()"
+# Each worker has its own connection pool (DB_POOL_SIZE + DB_MAX_OVERFLOW
+# in config.py); keep workers * pool below the database max_connections
+# and check usage per worker on /health/db.
+import os
+
+bind = os.environ.get('BIND', '127.0.0.1:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+# tell the app how many processes serve it (config.WEB_CONCURRENCY)
+os.environ['WEB_CONCURRENCY'] = str(workers)
+# recycle workers now and then, spread out so they do not reconnect at once
+max_requests = int(os.environ.get('MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+preload_app = os.environ.get('PRELOAD_APP', 'false').lower() in ('1', 'true', 'yes', 'on')
+
+
+def post_fork(server, worker):
+    # with preload_app the master may have opened connections; workers must
+    # not share them, so drop the inherited pool and let each worker connect
+    from models import db
+    try:
+        db.get_engine().dispose()
+    except RuntimeError:
+        pass
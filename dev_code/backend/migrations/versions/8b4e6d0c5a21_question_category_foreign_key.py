@@ -0,0 +1,63 @@
+"""questions.category as indexed integer foreign key
+
+Revision ID: 8b4e6d0c5a21
+Revises: 3f1c2a9d7b10
+Create Date: 2026-10-18 11:03:17.550914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b4e6d0c5a21'
+down_revision = '3f1c2a9d7b10'
+branch_labels = None
+depends_on = None
+
+
+def category_foreign_keys():
+    return [fk['name'] for fk in sa.inspect(op.get_bind()).get_foreign_keys('questions')
+            if fk['constrained_columns'] == ['category']]
+
+
+def upgrade():
+    is_postgres = op.get_bind().dialect.name == 'postgresql'
+
+    # backfill: categories that are not a number can not be converted
+    if is_postgres:
+        op.execute("UPDATE questions SET category = NULL WHERE category::text !~ '^[0-9]+$'")
+    else:
+        op.execute("UPDATE questions SET category = NULL WHERE trim(category, '0123456789') != ''")
+
+    with op.batch_alter_table('questions') as batch_op:
+        batch_op.alter_column('category',
+                              existing_type=sa.String(),
+                              type_=sa.Integer(),
+                              postgresql_using='category::text::integer')
+
+    # backfill: questions of categories that do not exist lose their category
+    op.execute('UPDATE questions SET category = NULL '
+               'WHERE category NOT IN (SELECT id FROM categories)')
+
+    # databases restored from trivia.psql already have the foreign key
+    has_foreign_key = bool(category_foreign_keys())
+    with op.batch_alter_table('questions') as batch_op:
+        if not has_foreign_key:
+            batch_op.create_foreign_key('fk_questions_category', 'categories',
+                                        ['category'], ['id'],
+                                        onupdate='CASCADE', ondelete='SET NULL')
+        batch_op.create_index('ix_questions_category_id', ['category', 'id'])
+
+
+def downgrade():
+    foreign_keys = category_foreign_keys()
+    with op.batch_alter_table('questions') as batch_op:
+        batch_op.drop_index('ix_questions_category_id')
+        # a string column can not reference categories.id
+        for name in foreign_keys:
+            batch_op.drop_constraint(name, type_='foreignkey')
+        batch_op.alter_column('category',
+                              existing_type=sa.Integer(),
+                              type_=sa.String(),
+                              postgresql_using='category::text')
@@ -0,0 +1,31 @@
+"""categories.question_count counter of the questions per category
+
+Revision ID: c2d7e9f41b36
+Revises: 8b4e6d0c5a21
+Create Date: 2026-10-18 15:42:08.214377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2d7e9f41b36'
+down_revision = '8b4e6d0c5a21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('categories') as batch_op:
+        batch_op.add_column(sa.Column('question_count', sa.Integer(),
+                                      nullable=False, server_default='0'))
+
+    # backfill: count the questions already in each category
+    op.execute('UPDATE categories SET question_count = '
+               '(SELECT count(*) FROM questions WHERE questions.category = categories.id)')
+
+
+def downgrade():
+    with op.batch_alter_table('categories') as batch_op:
+        batch_op.drop_column('question_count')
@@ -1,29 +1,114 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
-from config import database_setup, SQLALCHEMY_TRACK_MODIFICATIONS
-from flask_migrate import Migrate
+import time
+import threading
+from contextlib import contextmanager
+from sqlalchemy import Column, String, Integer, ForeignKey, Index, event, func, text
+from sqlalchemy.orm import Session, object_session, attributes
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm
+from config import (database_setup, DATABASE_URL, SQLALCHEMY_TRACK_MODIFICATIONS, CATEGORY_CACHE_TTL,
+                    QUESTION_COUNT_TTL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+                    DB_POOL_PRE_PING, DB_STATEMENT_TIMEOUT)
 
 
 
-database_path = "postgres://{}:{}@{}/{}".format(
-    database_setup['user_name'], database_setup['password'], database_setup['port'], database_setup['database_name'])
+database_path = DATABASE_URL or "postgresql://{}{}@{}/{}".format(
+    database_setup['user_name'],
+    ':' + database_setup['password'] if database_setup['password'] else '',
+    database_setup['port'], database_setup['database_name'])
+
+
+'''
+RoutingSession
+    session that reads from the replica engine set in info['replica'] (by
+    flaskr.replicas for read-only views), as long as it holds no pending
+    writes. Flushes and everything else go to the primary.
+'''
+class RoutingSession(SignallingSession):
+
+  def get_bind(self, mapper=None, clause=None):
+    replica = self.info.get('replica')
+    if replica is not None and not self._flushing and not (self.new or self.dirty or self.deleted):
+      return replica
+    return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+  def create_session(self, options):
+    return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
+
+'''
+engine_options(database_path)
+    SQLAlchemy engine and pool options from config.py for the database.
+    SQLite uses its own pool that takes no size, overflow or timeout.
+'''
+def engine_options(database_path):
+    if database_path.startswith('sqlite'):
+        return {}
+    options = {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING
+    }
+    if DB_STATEMENT_TIMEOUT and database_path.startswith('postgres'):
+        options['connect_args'] = {'options': '-c statement_timeout={}'.format(DB_STATEMENT_TIMEOUT)}
+    return options
+
+
+'''
+pool_status()
+    connections of the engine pool, for sizing pools against workers
+'''
+def pool_status():
+    pool = db.engine.pool
+    status = {'pool': type(pool).__name__}
+    for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+        if hasattr(pool, name):
+            status[name] = getattr(pool, name)()
+    if 'size' in status:
+        status['max_overflow'] = pool._max_overflow
+    return status
+
+
+'''
+ping_database()
+    round trip to the database, returns its latency in seconds
+'''
+def ping_database():
+    start = time.perf_counter()
+    db.session.execute(text('SELECT 1'))
+    return time.perf_counter() - start
 
-db = SQLAlchemy()
 
 '''
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service. Nothing connects
+    here: the engine connects on the first query, and the schema is only
+    changed by `flask db upgrade` or `flask init-db`
 '''
 def setup_db(app, database_path=database_path):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = SQLALCHEMY_TRACK_MODIFICATIONS
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path)
     db.app = app
     db.init_app(app)
-    # Creating an instance of the Migrate class
-    migrate = Migrate(app, db)
-    migrate.init_app(app, db)
-    db.create_all()
+
+
+'''
+setup_migrations(app)
+    registers Flask-Migrate for the `flask db` commands. Imported here
+    rather than at the top, as alembic is slow to import and only the
+    command line needs it
+'''
+def setup_migrations(app):
+    from flask_migrate import Migrate
+    Migrate(app, db, directory=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations'))
 
 
 '''
@@ -45,6 +130,25 @@ Define session Close, in case create_question fail
 '''
 def session_close():
     db.session.close()
+
+
+'''
+unit_of_work()
+    commits the request session when the block succeeds, rolls it back
+    when it raises. Model insert/update/delete only stage their change, so
+    a request commits once, in one place:
+        with unit_of_work():
+            question.insert()
+    The session itself is released when the app context tears down.
+'''
+@contextmanager
+def unit_of_work():
+    try:
+        yield db.session
+        db.session.commit()
+    except BaseException:
+        db.session.rollback()
+        raise
     
 
 
@@ -54,11 +158,13 @@ Question
 '''
 class Question(db.Model):  
   __tablename__ = 'questions'
+  # category filtered queries ordered by id are range scans of this index
+  __table_args__ = (Index('ix_questions_category_id', 'category', 'id'),)
 
   id = Column(Integer, primary_key=True)
   question = Column(String)
   answer = Column(String)
-  category = Column(String)
+  category = Column(Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='SET NULL'))
   difficulty = Column(Integer)
 
   def __init__(self, question, answer, category, difficulty):
@@ -69,22 +175,38 @@ class Question(db.Model):
 
   def insert(self):
     db.session.add(self)
-    # db.session.commit()
+
+  @classmethod
+  def bulk_insert(cls, mappings):
+    '''adds many questions given as dicts in one executemany, without
+    loading them as objects. Like insert, does not commit.'''
+    db.session.bulk_insert_mappings(cls, mappings)
+    deltas = {}
+    for mapping in mappings:
+      category = mapping.get('category')
+      deltas[category] = deltas.get(category, 0) + 1
+    for category, delta in deltas.items():
+      adjust_category_count(db.session, category, delta)
+    # bulk inserts skip the mapper events, flag the session for the
+    # data version and question counter by hand
+    db.session.info['data_changed'] = True
+    db.session.info['bulk_inserted'] = True
+    db.session.info['question_delta'] = db.session.info.get('question_delta', 0) + len(mappings)
 
   
   def update(self):
-    db.session.commit()
+    db.session.add(self)
 
   def delete(self):
     db.session.delete(self)
-    db.session.commit()
  
   def format(self):
     return {
       'id': self.id,
       'question': self.question,
       'answer': self.answer,
-      'category': self.category,
+      # kept a string, as the API always returned it
+      'category': str(self.category) if self.category is not None else None,
       'difficulty': self.difficulty
     }
 
@@ -97,6 +219,8 @@ class Category(db.Model):
 
   id = Column(Integer, primary_key=True)
   type = Column(String)
+  # questions in the category, maintained with every question write
+  question_count = Column(Integer, nullable=False, default=0, server_default='0')
 
   def __init__(self, type):
     self.type = type
@@ -106,3 +230,313 @@ class Category(db.Model):
       'id': self.id,
       'type': self.type
     }
+
+  def insert(self):
+    db.session.add(self)
+
+  def update(self):
+    db.session.add(self)
+
+  def delete(self):
+    db.session.delete(self)
+
+
+'''
+CategoryCache
+    in-process copy of the categories table, reloaded from the database
+    at most once per ttl seconds or after invalidate() is called.
+    Rows are kept as plain (id, type) tuples so they outlive the session.
+'''
+class CategoryCache:
+
+  def __init__(self, ttl=CATEGORY_CACHE_TTL):
+    self.ttl = ttl
+    self.hits = 0
+    self.misses = 0
+    self._rows = None
+    self._mapping = None
+    self._formatted = None
+    self._loaded_at = 0
+    self._lock = threading.Lock()
+
+  def _load(self):
+    with self._lock:
+      if self._rows is not None and time.monotonic() - self._loaded_at < self.ttl:
+        self.hits += 1
+        return
+      self.misses += 1
+      rows = db.session.query(Category.id, Category.type).order_by(Category.id).all()
+      self._rows = [(row.id, row.type) for row in rows]
+      self._mapping = {id: type for id, type in self._rows}
+      self._formatted = [{'id': id, 'type': type} for id, type in self._rows]
+      self._loaded_at = time.monotonic()
+
+  def mapping(self):
+    '''{id: type} of all categories ordered by id'''
+    self._load()
+    return self._mapping
+
+  def formatted(self):
+    '''list of Category.format() of all categories ordered by id'''
+    self._load()
+    return self._formatted
+
+  def invalidate(self):
+    with self._lock:
+      self._rows = None
+
+  def stats(self):
+    return {
+      'hits': self.hits,
+      'misses': self.misses,
+      'size': len(self._rows or ()),
+      'ttl': self.ttl
+    }
+
+
+category_cache = CategoryCache()
+
+
+'''
+Invalidate the category cache once the session that wrote a category row
+commits, so no request reloads the cache from rows that are not committed
+yet. Registered before the data version bump, so a response cached for the
+new version never sees the old categories.
+'''
+def _mark_categories_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+      session.info['categories_changed'] = True
+
+def _invalidate_category_cache(session):
+    if session.info.pop('categories_changed', False):
+      category_cache.invalidate()
+
+def _discard_categories_changed(session, previous_transaction):
+    session.info.pop('categories_changed', None)
+
+for _event in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Category, _event, _mark_categories_changed)
+event.listen(Session, 'after_commit', _invalidate_category_cache)
+event.listen(Session, 'after_soft_rollback', _discard_categories_changed)
+
+
+'''
+DataVersion
+    version of the questions and categories data, bumped after every
+    commit that wrote a question or category (Question.insert/update/delete,
+    Category.insert/update/delete). Cached responses are valid as long as
+    the version is unchanged.
+    Kept in this process by default; use(client) keeps it in Redis
+    (any redis-py compatible client) so all worker processes share it.
+    The version is counted again from 0 by a new process (or an emptied
+    Redis): validator() tells the counts apart with the epoch they started in.
+'''
+class DataVersion:
+
+  def __init__(self, key='trivia:data_version'):
+    self.key = key
+    self.client = None
+    self._version = 0
+    self._changed_at = time.time()
+    self._epoch = '{:x}'.format(int(time.time() * 1000000))
+    self._lock = threading.Lock()
+
+  def use(self, client):
+    self.client = client
+
+  def validator(self):
+    '''(epoch and version as one token, unix time of the last change)'''
+    if self.client is None:
+      with self._lock:
+        return '{}.{}'.format(self._epoch, self._version), self._changed_at
+    version, changed_at, epoch = self.client.mget(self.key, self.key + ':at', self.key + ':epoch')
+    if epoch is None:
+      # the first process using the store starts the epoch of its count
+      self.client.setnx(self.key + ':epoch', self._epoch)
+      epoch = self.client.get(self.key + ':epoch')
+    if isinstance(epoch, bytes):
+      epoch = epoch.decode('ascii')
+    return '{}.{}'.format(epoch, int(version or 0)), float(changed_at or self._changed_at)
+
+  def current(self):
+    '''(version, unix time of the last change)'''
+    if self.client is not None:
+      version, changed_at = self.client.mget(self.key, self.key + ':at')
+      return int(version or 0), float(changed_at or self._changed_at)
+    return self._version, self._changed_at
+
+  def bump(self):
+    if self.client is not None:
+      pipe = self.client.pipeline()
+      pipe.incr(self.key)
+      pipe.set(self.key + ':at', time.time())
+      pipe.execute()
+      return
+    with self._lock:
+      self._version += 1
+      self._changed_at = time.time()
+
+
+data_version = DataVersion()
+
+
+'''
+Bump the data version once the session that wrote a question or category
+commits, so no response is cached from data that is not committed yet.
+'''
+def _mark_data_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+      session.info['data_changed'] = True
+
+def _bump_data_version(session):
+    if session.info.pop('data_changed', False):
+      data_version.bump()
+
+def _discard_data_changed(session, previous_transaction):
+    session.info.pop('data_changed', None)
+
+for _model in (Question, Category):
+    for _event in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_model, _event, _mark_data_changed)
+event.listen(Session, 'after_commit', _bump_data_version)
+event.listen(Session, 'after_soft_rollback', _discard_data_changed)
+
+
+'''
+QuestionCounter
+    total number of questions, counted with COUNT(*) at most once per ttl
+    seconds and kept current in between by the inserts and deletes this
+    process commits, so reading the total costs O(1).
+'''
+class QuestionCounter:
+
+  def __init__(self, ttl=QUESTION_COUNT_TTL):
+    self.ttl = ttl
+    self._total = None
+    self._loaded_at = 0
+    self._lock = threading.Lock()
+
+  def total(self):
+    with self._lock:
+      if self._total is None or time.monotonic() - self._loaded_at >= self.ttl:
+        self._total = db.session.query(func.count(Question.id)).scalar()
+        self._loaded_at = time.monotonic()
+      return self._total
+
+  def apply(self, delta):
+    with self._lock:
+      if self._total is not None:
+        self._total += delta
+
+  def invalidate(self):
+    with self._lock:
+      self._total = None
+
+
+question_counter = QuestionCounter()
+
+
+'''
+Collect the inserted and deleted questions of a session and apply them to
+the question counter once the session commits.
+'''
+def _count_inserted_question(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+      session.info['question_delta'] = session.info.get('question_delta', 0) + 1
+
+def _count_deleted_question(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+      session.info['question_delta'] = session.info.get('question_delta', 0) - 1
+
+def _apply_question_delta(session):
+    delta = session.info.pop('question_delta', 0)
+    if delta:
+      question_counter.apply(delta)
+
+def _discard_question_delta(session, previous_transaction):
+    session.info.pop('question_delta', None)
+
+event.listen(Question, 'after_insert', _count_inserted_question)
+event.listen(Question, 'after_delete', _count_deleted_question)
+event.listen(Session, 'after_commit', _apply_question_delta)
+event.listen(Session, 'after_soft_rollback', _discard_question_delta)
+
+
+'''
+Category Question Counts
+    categories.question_count is kept in step with the questions of each
+    category by every question insert, update and delete, in the
+    transaction that writes the question, so per-category totals are read
+    from one row instead of counted.
+'''
+def adjust_category_count(connection, category, delta):
+    '''adds delta to the count of category, on a session or connection'''
+    if category is not None and delta:
+      categories = Category.__table__
+      connection.execute(categories.update()
+                         .where(categories.c.id == category)
+                         .values(question_count=categories.c.question_count + delta))
+
+def _committed_category(target):
+    history = attributes.get_history(target, 'category')
+    values = history.deleted or history.unchanged
+    return values[0] if values else None
+
+def _count_question_insert(mapper, connection, target):
+    adjust_category_count(connection, target.category, 1)
+
+def _count_question_update(mapper, connection, target):
+    history = attributes.get_history(target, 'category')
+    if history.has_changes():
+      adjust_category_count(connection, _committed_category(target), -1)
+      adjust_category_count(connection, target.category, 1)
+
+def _count_question_delete(mapper, connection, target):
+    adjust_category_count(connection, _committed_category(target), -1)
+
+event.listen(Question, 'after_insert', _count_question_insert)
+event.listen(Question, 'after_update', _count_question_update)
+event.listen(Question, 'after_delete', _count_question_delete)
+
+
+'''
+category_question_counts()
+    {category id: number of questions} from the counters, one small query
+'''
+def category_question_counts():
+    return dict(db.session.query(Category.id, Category.question_count))
+
+
+'''
+category_question_count(category_id)
+    number of questions of one category from its counter, 0 if unknown
+'''
+def category_question_count(category_id):
+    count = db.session.query(Category.question_count).filter(Category.id == category_id).scalar()
+    return count or 0
+
+
+'''
+reconcile_category_counts()
+    recounts the questions of every category and fixes the counters that
+    drifted (writes through raw SQL, restores, manual edits). Returns
+    {category id: (stored count, actual count)} of the fixed categories.
+    The fix is one UPDATE, so concurrent question writes are not lost.
+    Does not commit, like the model methods.
+'''
+def reconcile_category_counts():
+    actual = (db.session.query(func.count(Question.id))
+              .filter(Question.category == Category.id)
+              .correlate(Category)
+              .as_scalar())
+    drifted = {id: (stored, count) for id, stored, count in
+               db.session.query(Category.id, Category.question_count, actual)
+                         .filter(Category.question_count != actual)}
+    if drifted:
+      db.session.query(Category).filter(Category.question_count != actual) \
+                .update({Category.question_count: actual}, synchronize_session=False)
+    return drifted
@@ -0,0 +1,37 @@
+'''
+Request profiles of the trivia API, written by flaskr.profiler.
+
+    python profile_report.py report [--dir DIR] [--top N] [--sort KEY] [--endpoint NAME]
+    python profile_report.py sign      (prints a signed X-Profile header value)
+'''
+import argparse
+import os
+from config import PROFILE_DIR, PROFILE_SECRET
+from flaskr.profiler import HEADER, RequestProfiler, report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Request profiles of the trivia API.')
+    commands = parser.add_subparsers(dest='command')
+    report_parser = commands.add_parser('report', help='top functions per endpoint')
+    report_parser.add_argument('--dir', default=PROFILE_DIR)
+    report_parser.add_argument('--top', type=int, default=20)
+    report_parser.add_argument('--sort', default='cumulative', help='pstats sort key, e.g. tottime')
+    report_parser.add_argument('--endpoint', default=None)
+    commands.add_parser('sign', help='print a signed X-Profile header value')
+    args = parser.parse_args(argv)
+
+    if args.command == 'report':
+      if not os.path.isdir(args.dir):
+        parser.error('no profiles in {}'.format(args.dir))
+      report(args.dir, args.top, args.sort, args.endpoint)
+    elif args.command == 'sign':
+      if not PROFILE_SECRET:
+        parser.error('set PROFILE_SECRET to sign profile requests')
+      print('{}: {}'.format(HEADER, RequestProfiler(PROFILE_DIR, secret=PROFILE_SECRET).sign()))
+    else:
+      parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
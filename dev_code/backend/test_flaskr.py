@@ -1,38 +1,148 @@
 import os
+import glob
+import hashlib
+import subprocess
 import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from flaskr.pagination import QUESTIONS_PER_PAGE
+from models import db, setup_migrations, Question, Category, category_cache, question_counter, data_version
 from config import database_setup
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import Session
 from sqlalchemy import desc
+#----------------------------------------------------------------------------#
+# Test Database
+#----------------------------------------------------------------------------#
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+# trivia_test is the template: trivia.psql plus the migrations, built once
+# and rebuilt only when one of them changes. Every test process (each
+# pytest-xdist worker) runs on its own copy of it.
+TEMPLATE_DATABASE = database_setup['database_name_test']
+TEST_DATABASE = '{}_{}'.format(TEMPLATE_DATABASE, os.environ.get('PYTEST_XDIST_WORKER', 'main'))
+# any constant, shared by the test processes building the template
+TEMPLATE_LOCK = 7140512
+
+'''
+Database Url
+Parameters: database name
+Return: SQLAlchemy url of the database on the server of config.database_setup
+'''
+def database_url(name):
+    return "postgresql://{}{}@{}/{}".format(
+        database_setup['user_name'],
+        ':' + database_setup['password'] if database_setup['password'] else '',
+        database_setup['port'], name)
+
+'''
+Template Fingerprint
+Return: hash of trivia.psql and of the migrations the template is built from
+'''
+def template_fingerprint():
+    digest = hashlib.sha1()
+    paths = [os.path.join(BACKEND_DIR, 'trivia.psql')]
+    paths += sorted(glob.glob(os.path.join(BACKEND_DIR, 'migrations', 'versions', '*.py')))
+    for path in paths:
+      with open(path, 'rb') as f:
+        digest.update(f.read())
+    return digest.hexdigest()
 
+'''
+Build Template
+Parameters: autocommit connection to the maintenance database, fingerprint
+Return: None, (re)creates the template database from trivia.psql and
+        upgrades it to the latest migration
+'''
+def build_template(server, fingerprint):
+    from flask_migrate import upgrade
+
+    server.execute(text('DROP DATABASE IF EXISTS "{}"'.format(TEMPLATE_DATABASE)))
+    server.execute(text('CREATE DATABASE "{}"'.format(TEMPLATE_DATABASE)))
+    # the dump names its owner role, psql goes on when it does not exist
+    subprocess.run(['psql', '-q', '-X', '-d', database_url(TEMPLATE_DATABASE),
+                    '-f', os.path.join(BACKEND_DIR, 'trivia.psql')],
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database_url(TEMPLATE_DATABASE)})
+    setup_migrations(app)
+    with app.app_context():
+      upgrade(directory=os.path.join(BACKEND_DIR, 'migrations'))
+      # no connection may stay open on a database being copied
+      db.session.remove()
+      db.get_engine(app).dispose()
+    server.execute(text("COMMENT ON DATABASE \"{}\" IS '{}'".format(TEMPLATE_DATABASE, fingerprint)))
+
+def setUpModule():
+    """Copy the template into the database of this test process, building
+    the template first when it is missing or out of date."""
+    engine = create_engine(database_url('postgres'), isolation_level='AUTOCOMMIT')
+    with engine.connect() as server:
+      # one process builds the template while the others wait
+      server.execute(text('SELECT pg_advisory_lock(:key)'), key=TEMPLATE_LOCK)
+      try:
+        fingerprint = template_fingerprint()
+        built = server.execute(text(
+            "SELECT shobj_description(oid, 'pg_database') FROM pg_database WHERE datname = :name"),
+            name=TEMPLATE_DATABASE).scalar()
+        if built != fingerprint:
+          build_template(server, fingerprint)
+        server.execute(text('DROP DATABASE IF EXISTS "{}"'.format(TEST_DATABASE)))
+        server.execute(text('CREATE DATABASE "{}" TEMPLATE "{}"'.format(TEST_DATABASE, TEMPLATE_DATABASE)))
+      finally:
+        server.execute(text('SELECT pg_advisory_unlock(:key)'), key=TEMPLATE_LOCK)
+    engine.dispose()
+#----------------------------------------------------------------------------#
+# Test Case
+#----------------------------------------------------------------------------#
 class TriviaTestCase(unittest.TestCase):
     """This class represents the trivia test case"""
 
+    @classmethod
+    def setUpClass(cls):
+        """One app for every test, on the database of this test process."""
+        cls.database_path = database_url(TEST_DATABASE)
+        cls.app = create_app({'SQLALCHEMY_DATABASE_URI': cls.database_path})
+
     def setUp(self):
-        """Define test variables and initialize app."""
-        self.app = create_app()
+        """Run the test in a transaction that tearDown rolls back.
+        The app commits and rolls back as usual: db.session is bound to one
+        connection holding a savepoint; a commit of the app releases it, a
+        rollback of the app rolls back to it, and a new one is taken."""
         self.client = self.app.test_client
-        self.database_name = "trivia"
-        self.database_name = "trivia_test"
-        # self.database_path = "postgres://{}/{}".format('postgres', '','localhost:5432', self.database_name)
-        self.database_path = "postgresql://{}:{}@{}/{}".format(
-            'postgres', '', 'localhost:5432', self.database_name)
-        
-        setup_db(self.app, self.database_path)
+        self.connection = db.get_engine(self.app).connect()
+        self.transaction = self.connection.begin()
+        self.savepoint = self.connection.begin_nested()
+        self.app_session = db.session
+        db.session = db.create_scoped_session({'bind': self.connection, 'binds': {}})
+        # on Session itself, listeners of a new session class would hide
+        # the ones models registered on Session
+        self.listeners = [('after_commit', self.release_savepoint),
+                          ('after_rollback', self.restore_savepoint)]
+        for name, listener in self.listeners:
+            event.listen(Session, name, listener)
+
+    def release_savepoint(self, session):
+        if session.bind is self.connection:
+          self.savepoint.commit()
+          self.savepoint = self.connection.begin_nested()
+
+    def restore_savepoint(self, session):
+        if session.bind is self.connection and not self.savepoint.is_active:
+          self.savepoint = self.connection.begin_nested()
 
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
-    
     def tearDown(self):
         """Executed after reach test"""
-        pass
+        for name, listener in self.listeners:
+            event.remove(Session, name, listener)
+        db.session.remove()
+        db.session = self.app_session
+        self.transaction.rollback()
+        self.connection.close()
+        # in-process caches may still hold the rolled back writes, and
+        # cached responses are only valid for the data version they saw
+        question_counter.invalidate()
+        category_cache.invalidate()
+        data_version.bump()
 
     """
     TODO
@@ -50,6 +160,50 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(data['categories'])
         
+    def test_get_categories_served_from_cache(self):
+        from models import category_cache
+        category_cache.invalidate()
+        self.client().get('/categories')
+        misses = category_cache.misses
+        res = self.client().get('/questions?page=1')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['categories'])
+        self.assertEqual(category_cache.misses, misses)
+
+    def test_category_cache_invalidated_on_commit(self):
+        with self.app.app_context():
+            category_cache.mapping()
+            category = Category(type='Phantom')
+            db.session.add(category)
+            db.session.flush()
+            # another request reloading now must not see the uncommitted row
+            self.assertNotIn(category.id, category_cache.mapping())
+            db.session.rollback()
+            self.assertNotIn('Phantom', category_cache.mapping().values())
+
+            category = Category(type='Committed')
+            db.session.add(category)
+            db.session.commit()
+            self.assertEqual(category_cache.mapping()[category.id], 'Committed')
+
+    def test_get_categories_with_counts(self):
+        from models import reconcile_category_counts
+        new_question = {'question': 'Counted ?', 'answer': 'Yes', 'category': '3', 'difficulty': 1}
+        created = json.loads(self.client().post('/questions', json=new_question).data)['created']
+        self.client().delete('/questions/{}'.format(created))
+
+        res = self.client().get('/categories?with_counts=1')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        with self.app.app_context():
+            for category in Category.query.all():
+                self.assertEqual(data['question_counts'][str(category.id)],
+                                 Question.query.filter(Question.category == category.id).count())
+            self.assertEqual(reconcile_category_counts(), {})
+
     def test_405_post_categories(self):
         """Wrong method POST"""
         res = self.client().post('/categories')
@@ -71,6 +225,132 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['questions'])
         self.assertTrue(len(data['questions']))
 
+    def test_get_questions_with_cursor(self):
+        res = self.client().get('/questions?page=1')
+        data = json.loads(res.data)
+        self.assertTrue(data['next_cursor'])
+
+        res = self.client().get('/questions?cursor={}'.format(data['next_cursor']))
+        next_page = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(next_page['questions'])
+        self.assertTrue(next_page['questions'][0]['id'] > data['questions'][-1]['id'])
+        self.assertEqual(next_page['total_questions'], data['total_questions'])
+
+    def test_get_questions_last_full_page_without_cursor(self):
+        total_questions = json.loads(self.client().get('/questions?page=1').data)['total_questions']
+        while total_questions % QUESTIONS_PER_PAGE:
+            self.client().post('/questions', json={
+                'question': 'Question #{} ?'.format(total_questions),
+                'answer': 'Answer',
+                'category': 3,
+                'difficulty': 1
+            })
+            total_questions += 1
+
+        res = self.client().get('/questions?page={}'.format(total_questions // QUESTIONS_PER_PAGE))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['questions']), QUESTIONS_PER_PAGE)
+        self.assertIsNone(data['next_cursor'])
+
+    def test_400_get_questions_with_invalid_cursor(self):
+        res = self.client().get('/questions?cursor=@@@')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'Invalid pagination cursor.')
+
+    def test_400_get_questions_with_oversized_cursor(self):
+        from flaskr.pagination import encode_cursor
+        from flaskr.read_model import read_model
+        url = '/questions?cursor={}'.format(encode_cursor('9' * 30))
+
+        res = self.client().get(url)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(json.loads(res.data)['message'], 'Invalid pagination cursor.')
+
+        read_model.configure(True)
+        try:
+            res = self.client().get(url)
+            self.assertEqual(res.status_code, 400)
+        finally:
+            read_model.configure(False)
+
+    def test_304_get_questions_not_modified(self):
+        res = self.client().get('/questions?page=1')
+        etag = res.headers['ETag']
+
+        res = self.client().get('/questions?page=1', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers['ETag'], etag)
+
+        self.client().post('/questions', json={
+            'question': 'Question #2 ?',
+            'answer': 'Answer #2',
+            'category': '3',
+            'difficulty': 1
+        })
+        res = self.client().get('/questions?page=1', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_304_not_sent_after_restart(self):
+        res = self.client().get('/questions?page=1')
+        etag = res.headers['ETag']
+        self.assertNotIn('Last-Modified', res.headers)
+
+        # a new process counts the in-memory version again, in a new epoch
+        epoch, data_version._epoch = data_version._epoch, 'restarted'
+        try:
+            res = self.client().get('/questions?page=1', headers={'If-None-Match': etag})
+            self.assertEqual(res.status_code, 200)
+        finally:
+            data_version._epoch = epoch
+
+        # the in-memory time of change does not survive a restart either
+        res = self.client().get('/questions?page=1', headers={
+            'If-Modified-Since': 'Mon, 01 Jan 2120 00:00:00 GMT'})
+        self.assertEqual(res.status_code, 200)
+
+    def test_get_questions_gzip(self):
+        import gzip
+        plain = self.client().get('/questions?page=1')
+        res = self.client().get('/questions?page=1', headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', res.headers['Vary'])
+        self.assertEqual(json.loads(gzip.decompress(res.data)), json.loads(plain.data))
+        self.assertTrue(res.headers['ETag'].startswith('W/'))
+
+        res = self.client().get('/questions?page=1', headers={
+            'Accept-Encoding': 'gzip', 'If-None-Match': res.headers['ETag']})
+        self.assertEqual(res.status_code, 304)
+        # small bodies are sent as they are
+        res = self.client().get('/categories', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', res.headers)
+
+    def test_rollback_keeps_data_version(self):
+        with self.app.app_context():
+            version = data_version.current()[0]
+            db.session.add(Question(question='Question #3 ?', answer='Answer #3',
+                                    category=3, difficulty=1))
+            db.session.flush()
+            db.session.rollback()
+
+            self.assertEqual(data_version.current()[0], version)
+
+    def test_404_delete_not_existing_question(self):
+        res = self.client().delete('/questions/100000')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'resource not found')
+
     def test_404_sent_requesting_not_valid_page(self):
         res = self.client().get('/books?page=500',json={'category:': 'science'})
         data = json.loads(res.data)
@@ -98,6 +378,23 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['questions'])
         self.assertTrue(len(data['questions']))
  
+    def test_create_new_question_minimal_response(self):
+        new_question = {
+            'question': 'Question #1 ?',
+            'answer': 'Answer #1',
+            'category': '3',
+            'difficulty': 4
+        }
+
+        res = self.client().post('/questions?return=minimal', json= new_question)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['created'])
+        self.assertTrue(data['total_questions'])
+        self.assertNotIn('questions', data)
+        self.assertEqual(res.headers['Preference-Applied'], 'return=minimal')
+
     def test_400_create_new_question(self):
         new_question = {
             'question': None,
@@ -112,6 +409,78 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 400)
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'Question can not be blank')
+
+    def test_400_create_new_question_invalid_category(self):
+        new_question = {
+            'question': 'Question #1 ?',
+            'answer': 'Answer #1',
+            'category': 'Science',
+            'difficulty': 4
+        }
+
+        res = self.client().post('/questions', json = new_question)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'Category id is not valid.')
+
+    def test_bulk_create_questions(self):
+        body = '\n'.join([
+            json.dumps({'question': 'Bulk #1 ?', 'answer': 'Answer #1', 'category': '1', 'difficulty': 1}),
+            json.dumps({'question': 'Bulk #2 ?', 'answer': 'Answer #2', 'category': '2', 'difficulty': 2}),
+            json.dumps({'question': '', 'answer': 'Answer #3', 'category': '2', 'difficulty': 2})
+        ])
+
+        res = self.client().post('/questions/bulk?batch_size=1', data=body,
+                                 content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['inserted'], 2)
+        self.assertEqual(data['errors'], [{'line': 3, 'message': 'Question can not be blank'}])
+
+    def test_bulk_create_questions_not_utf8(self):
+        body = b'question,answer,category,difficulty\nBulk \xff ?,Answer,1,1\nBulk #2 ?,Answer #2,1,1\n'
+
+        res = self.client().post('/questions/bulk', data=body, content_type='text/csv')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual(data['errors'], [{'line': 2, 'message': 'Line is not valid UTF-8.'}])
+
+    def test_400_bulk_create_questions(self):
+        res = self.client().post('/questions/bulk', data='',
+                                 content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'Please provide questions.')
+
+    def test_export_questions(self):
+        res = self.client().get('/questions/export?format=csv')
+        lines = res.data.decode('utf-8').splitlines()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(lines[0], 'id,question,answer,category,difficulty')
+        self.assertEqual(len(lines) - 1, json.loads(self.client().get('/questions').data)['total_questions'])
+
+    def test_get_questions_fields(self):
+        res = self.client().get('/questions?page=1&fields=question')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(set(data['questions'][0]), {'id', 'question'})
+
+    def test_400_get_questions_unknown_fields(self):
+        res = self.client().get('/questions?page=1&fields=question,rating')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['message'], 'Unknown question fields: rating.')
+
 #----------------------------------------------------------------------------#
 # Test # 3 POST /questions/search
 #----------------------------------------------------------------------------#
@@ -128,6 +497,32 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(len(data['questions']))
         self.assertTrue(data['total_questions'])
 
+    def test_search_questions_ranked(self):
+        search = {
+            'searchTerm': 'the',
+            'rank': True
+        }
+
+        res = self.client().post('/questions/search', json=search)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertTrue(len(data['questions']))
+        for question in data['questions']:
+            self.assertIn('the', question['question'].lower())
+
+    def test_search_index_skips_rolled_back_questions(self):
+        from flaskr.search import question_index
+        with self.app.app_context():
+            self.assertTrue(question_index.match('egyptians'))
+            db.session.add(Question(question='Which phantom was never committed?',
+                                    answer='Answer', category=3, difficulty=1))
+            db.session.flush()
+            db.session.rollback()
+
+            self.assertEqual(question_index.match('phantom'), [])
+
     def test_404_search_questions(self):
         search = {
             'searchTerm': 'Kuwait'
@@ -138,8 +533,75 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 404)
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'No questions contains found.')
+
+    def test_suggest_questions(self):
+        res = self.client().post('/questions', json={
+            'question': 'Zanzibar lies off the coast of which country?',
+            'answer': 'Tanzania',
+            'category': 3,
+            'difficulty': 2
+        })
+        question_id = json.loads(res.data)['created']
+
+        res = self.client().get('/questions/suggest?prefix=zanz')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['suggestions'], [
+            {'text': 'Zanzibar lies off the coast of which country?', 'field': 'question'}])
+
+        self.client().delete('/questions/{}'.format(question_id))
+        res = self.client().get('/questions/suggest?prefix=zanz')
+        data = json.loads(res.data)
+
+        self.assertEqual(data['suggestions'], [])
+
+    def test_suggest_questions_written_by_other_workers(self):
+        try:
+            import fakeredis
+        except ImportError:
+            self.skipTest('fakeredis is not installed')
+        from models import DataVersion, unit_of_work
+        from flaskr.suggest import question_suggestions
+        self.client().get('/questions/suggest?prefix=zanz')
+
+        def other_worker_writes(question):
+            # no mapper events: this process only learns of it from the data version
+            with self.app.app_context(), unit_of_work():
+                db.session.execute(Question.__table__.insert(), {
+                    'question': question, 'answer': 'Tanzania', 'category': 3, 'difficulty': 2})
+
+        store = fakeredis.FakeRedis()
+        other = DataVersion()
+        other.use(store)
+        data_version.use(store)
+        try:
+            other_worker_writes('Zanzibar lies off the coast of which country?')
+            other.bump()
+            res = self.client().get('/questions/suggest?prefix=zanz')
+            self.assertEqual(len(json.loads(res.data)['suggestions']), 1)
+        finally:
+            data_version.use(None)
+
+        # a data version of this process only: the index is built again once too old
+        question_suggestions.configure(question_suggestions.size, max_age=0)
+        try:
+            other_worker_writes('Zanzibar is part of which country?')
+            res = self.client().get('/questions/suggest?prefix=zanz')
+            self.assertEqual(len(json.loads(res.data)['suggestions']), 2)
+        finally:
+            question_suggestions.configure(question_suggestions.size)
+
+    def test_400_suggest_questions(self):
+        res = self.client().get('/questions/suggest?prefix=')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'Please provide a prefix.')
 #----------------------------------------------------------------------------#
-# Tests #4 GET /categories/<string:category_id>/questions
+# Tests #4 GET /categories/<int:category_id>/questions
 #----------------------------------------------------------------------------#
     def test_get_questions_by_category(self):
         res = self.client().get('/categories/2/questions')
@@ -175,6 +637,80 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(data['question']['id']not in quiz_data['previous_questions'])
         
+    def test_play_quiz_without_category(self):
+        quiz_data = {
+            'previous_questions': [2, 4, 5, 6, 9, 10],
+            'quiz_category': None
+        }
+        res = self.client().post('/quizzes', json=quiz_data)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['question']['id'] not in quiz_data['previous_questions'])
+
+    def test_play_quiz_round(self):
+        quiz_data = {
+            'previous_questions': [20],
+            'quiz_category': {'type': 'Science', 'id': 1},
+            'count': 5
+        }
+        res = self.client().post('/quizzes', json=quiz_data)
+        data = json.loads(res.data)
+        ids = [question['id'] for question in data['questions']]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(1 <= len(ids) <= 5)
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertNotIn(20, ids)
+        self.assertTrue(all(question['category'] == '1' for question in data['questions']))
+        self.assertEqual(data['question'], data['questions'][0])
+
+    def test_400_play_quiz_round_count(self):
+        res = self.client().post('/quizzes', json={'previous_questions': [], 'count': 0})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_play_quiz_difficulty_curve(self):
+        res = self.client().post('/quizzes', json={
+            'previous_questions': [],
+            'count': 5,
+            'difficulty_curve': [1, 2, 3, 4, 5]
+        })
+        data = json.loads(res.data)
+        difficulties = [question['difficulty'] for question in data['questions']]
+
+        self.assertEqual(res.status_code, 200)
+        # the bank has no question of difficulty 5, the nearest one is dealt
+        self.assertEqual(difficulties, [1, 2, 3, 4, 4])
+
+    def test_play_quiz_difficulty_weights(self):
+        quiz_data = {
+            'previous_questions': [],
+            'quiz_category': {'type': 'Art', 'id': 2},
+            'difficulty_weights': {'4': 1}
+        }
+        with self.app.app_context():
+            expected = [question.id for question in Question.query.filter(
+                Question.category == 2, Question.difficulty == 4)]
+        res = self.client().post('/quizzes', json=quiz_data)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(data['question']['id'], expected)
+
+    def test_400_play_quiz_difficulty(self):
+        res = self.client().post('/quizzes', json={
+            'previous_questions': [],
+            'difficulty_curve': [1, 6]
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['message'], 'Difficulty curve must list difficulties between 1 and 5.')
+
     def test_400_play_quiz_with_body(self):
         res = self.client().post('/quizzes')
         data = json.loads(res.data)
@@ -184,6 +720,151 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(
             data['message'], 'Please provide quiz data.')
+#----------------------------------------------------------------------------#
+# Tests #6 POST /quizzes/sessions
+#----------------------------------------------------------------------------#
+    def test_play_quiz_session(self):
+        res = self.client().post('/quizzes/sessions', json={
+            'quiz_category': {'type': 'Art', 'id': '2'}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['session'])
+        self.assertTrue(data['total_questions'])
+
+        asked = []
+        for _ in range(data['total_questions']):
+            res = self.client().post('/quizzes/sessions/{}/next'.format(data['session']))
+            question = json.loads(res.data)['question']
+            self.assertEqual(question['category'], '2')
+            self.assertTrue(question['id'] not in asked)
+            asked.append(question['id'])
+
+        res = self.client().post('/quizzes/sessions/{}/next'.format(data['session']))
+        self.assertEqual(json.loads(res.data)['question'], None)
+
+    def test_404_next_question_unknown_session(self):
+        res = self.client().post('/quizzes/sessions/unknown/next')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'Quiz session not found.')
+
+    def test_no_memory_quiz_sessions_with_several_workers(self):
+        from flaskr.quiz_sessions import create_deck_store, MemoryDeckStore
+        self.assertIsInstance(create_deck_store('memory', 60, 1), MemoryDeckStore)
+        self.assertIsNone(create_deck_store('memory', 60, 2))
+#----------------------------------------------------------------------------#
+# Tests #7 GET /health/db, GET /metrics
+#----------------------------------------------------------------------------#
+    def test_get_health_db(self):
+        res = self.client().get('/health/db')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['database'], 'ok')
+        self.assertIn('checkedout', data['pool'])
+
+    def test_get_metrics(self):
+        res = self.client().get('/questions?page=1')
+        self.assertIn('queries', res.headers['Server-Timing'])
+
+        res = self.client().get('/metrics')
+        text = res.data.decode('utf-8')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('trivia_request_duration_seconds_count{endpoint="get_questions"}', text)
+        self.assertIn('trivia_db_statements_total{endpoint="get_questions"}', text)
+
+    def test_read_model_serves_pages_and_quizzes(self):
+        from flaskr.read_model import read_model
+        read_model.configure(True)
+        try:
+            with self.app.test_request_context('/questions?page=1'):
+                self.assertTrue(read_model.active())
+                from flask import request
+                from flaskr.pagination import paginate_questions
+                self.assertEqual(read_model.paginate(request),
+                                 paginate_questions(request, Question.query))
+                self.assertEqual(read_model.count(1),
+                                 Question.query.filter(Question.category == 1).count())
+                picked = read_model.sample(1, [20], 2)
+                self.assertTrue(all(question['category'] == '1' for question in picked))
+                self.assertNotIn(20, [question['id'] for question in picked])
+        finally:
+            read_model.configure(False)
+
+    def test_read_model_off_without_shared_version(self):
+        from flaskr.read_model import read_model
+        read_model.configure(True, 'version', shared_version=False)
+        try:
+            with self.app.test_request_context('/questions?page=1'):
+                self.assertFalse(read_model.active())
+        finally:
+            read_model.configure(False)
+
+    def test_read_replica_routing(self):
+        from flask import Response
+        from flaskr.replicas import ReplicaRouter
+        from models import db
+        replica_url = os.environ.get('DATABASE_REPLICA_URL', self.database_path)
+        replicas = ReplicaRouter([replica_url], sticky_seconds=0)
+        replicas.init_app(self.app)
+        binds = []
+        view = replicas.reads(lambda: binds.append(db.session.get_bind()) or 'read')
+
+        with self.app.test_request_context('/questions'):
+            self.assertEqual(view(), 'read')
+            self.assertIsNone(db.session.info.get('replica'))
+        self.assertEqual(str(binds[0].url), replica_url)
+        self.assertTrue(replicas.status()[0]['healthy'])
+
+        def chunks():
+            binds.append(db.session.get_bind())
+            yield 'read'
+        streamed = replicas.reads(lambda: Response(chunks()))
+
+        with self.app.test_request_context('/questions/export'):
+            response = streamed()
+            self.assertIsNone(db.session.info.get('replica'))
+            self.assertEqual(b''.join(response.iter_encoded()), b'read')
+            response.close()
+            self.assertIsNone(db.session.info.get('replica'))
+            self.assertIs(binds[1], db.get_engine(bind='replica_0'))
+
+#----------------------------------------------------------------------------#
+# Tests #8 async app (flaskr.asgi)
+#----------------------------------------------------------------------------#
+    def test_asgi_app_same_contract(self):
+        try:
+            from starlette.testclient import TestClient
+            from flaskr.asgi import create_asgi_app
+        except ImportError:
+            self.skipTest('starlette and databases are not installed')
+
+        with TestClient(create_asgi_app(self.database_path)) as client:
+            res = client.get('/questions?page=1')
+            expected = json.loads(self.client().get('/questions?page=1').data)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.json()['questions'], expected['questions'])
+            self.assertEqual(res.json()['total_questions'], expected['total_questions'])
+
+            res = client.get('/questions?cursor=OTk5OTk5OTk5OTk5OTk5OTk5OTk5OTk5OTk5OTk5')
+            self.assertEqual(res.status_code, 400)
+
+            # a wildcard in the term is matched literally
+            res = client.post('/questions/search', json={'searchTerm': '%'})
+            self.assertEqual(res.status_code, 404)
+
+            res = client.post('/quizzes', json={})
+            self.assertEqual(res.status_code, 400)
+            self.assertEqual(res.json()['success'], False)
+            self.assertEqual(res.json()['message'], 'Please provide quiz data.')
+
+            res = client.post('/quizzes', json={'quiz_category': {'id': 1}, 'count': 2,
+                                                'difficulty_curve': [1, 2]})
+            self.assertEqual(res.status_code, 400)
 
 # Make the tests conveniently executable
 if __name__ == "__main__":
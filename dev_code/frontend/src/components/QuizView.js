@@ -15,6 +15,7 @@ class QuizView extends Component {
         categories: {},
         numCorrect: 0,
         currentQuestion: {},
+        upcomingQuestions: [],
         guess: '',
         forceEnd: false
     }
@@ -50,6 +51,18 @@ class QuizView extends Component {
     const previousQuestions = [...this.state.previousQuestions]
     if(this.state.currentQuestion.id) { previousQuestions.push(this.state.currentQuestion.id) }
 
+    // the round is dealt in one request, play it from memory
+    if(this.state.upcomingQuestions.length) {
+      this.setState({
+        showAnswer: false,
+        previousQuestions: previousQuestions,
+        currentQuestion: this.state.upcomingQuestions[0],
+        upcomingQuestions: this.state.upcomingQuestions.slice(1),
+        guess: ''
+      })
+      return;
+    }
+
     $.ajax({
       url: '/quizzes', //TODO: update request URL
       type: "POST",
@@ -57,7 +70,8 @@ class QuizView extends Component {
       contentType: 'application/json',
       data: JSON.stringify({
         previous_questions: previousQuestions,
-        quiz_category: this.state.quizCategory
+        quiz_category: this.state.quizCategory,
+        count: Math.max(1, questionsPerPlay - previousQuestions.length)
       }),
       xhrFields: {
         withCredentials: true
@@ -68,6 +82,7 @@ class QuizView extends Component {
           showAnswer: false,
           previousQuestions: previousQuestions,
           currentQuestion: result.question,
+          upcomingQuestions: (result.questions || []).slice(1),
           guess: '',
           forceEnd: result.question ? false : true
         })
@@ -103,6 +118,7 @@ class QuizView extends Component {
       showAnswer: false,
       numCorrect: 0,
       currentQuestion: {},
+      upcomingQuestions: [],
       guess: '',
       forceEnd: false
     })
@@ -1,8 +1,10 @@
 import React, { Component } from 'react'
+import $ from 'jquery';
 
 class Search extends Component {
   state = {
     query: '',
+    suggestions: [],
   }
 
   getInfo = (event) => {
@@ -14,6 +16,33 @@ class Search extends Component {
     this.setState({
       query: this.search.value
     })
+    this.getSuggestions(this.search.value)
+  }
+
+  getSuggestions = (prefix) => {
+    // only the answer to the last keystroke matters
+    if (this.suggestRequest) {
+      this.suggestRequest.abort()
+    }
+    if (!prefix.trim()) {
+      this.setState({ suggestions: [] })
+      return
+    }
+    this.suggestRequest = $.ajax({
+      url: `/questions/suggest?prefix=${encodeURIComponent(prefix)}`,
+      type: "GET",
+      success: (result) => {
+        // the search matches question texts, answers would find nothing
+        this.setState({
+          suggestions: result.suggestions.filter(suggestion => suggestion.field === 'question')
+        })
+        return;
+      },
+      error: (error) => {
+        // without suggestions the search still works
+        return;
+      }
+    })
   }
 
   render() {
@@ -23,7 +52,14 @@ class Search extends Component {
           placeholder="Search questions..."
           ref={input => this.search = input}
           onChange={this.handleInputChange}
+          list="search-suggestions"
+          autoComplete="off"
         />
+        <datalist id="search-suggestions">
+          {this.state.suggestions.map(suggestion => (
+            <option key={suggestion.text} value={suggestion.text} />
+          ))}
+        </datalist>
         <input type="submit" value="Submit" className="button"/>
       </form>
     )